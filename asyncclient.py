@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Asynchronous transport for the pbs write operations.
+
+This module exports the following class:
+    * AsyncClient: send create, update and delete requests concurrently
+      from one asyncio event loop.
+
+It needs the optional aiohttp package: pip install pybossa-pbs[async]
+"""
+import json
+import pbclient
+from requests import exceptions
+from pbsretry import RETRY_LATER_CODES, retry_later
+
+# asyncio and aiohttp are slow to import, they are loaded by AsyncClient
+asyncio = None
+aiohttp = None
+
+
+__all__ = ['AsyncClient']
+
+
+class AsyncClient(object):
+
+    """Send pbclient write calls concurrently over one event loop."""
+
+    def __init__(self, endpoint, api_key, governor, limit=100):
+        """Init method."""
+        global asyncio, aiohttp
+        try:
+            import asyncio
+            import aiohttp
+        except ImportError:
+            raise ImportError("The aiohttp package is required: "
+                              "pip install pybossa-pbs[async]")
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.governor = governor
+        self.limit = limit
+        self.loop = None
+        self.session = None
+
+    def _start(self):
+        """Create the event loop and the HTTP session on first use."""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.session = self.loop.run_until_complete(self._open())
+
+    async def _open(self):
+        """Return a new HTTP session (it must be created inside the loop)."""
+        connector = aiohttp.TCPConnector(limit=self.limit)
+        return aiohttp.ClientSession(connector=connector)
+
+    def close(self):
+        """Close the HTTP session and the event loop."""
+        if self.loop is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.loop.close()
+            self.loop = None
+            self.session = None
+
+    async def _wait(self):
+        """Wait without blocking the loop until the governor has a token."""
+        sleep = self.governor.acquire()
+        while sleep > 0:
+            await asyncio.sleep(sleep)
+            sleep = self.governor.acquire()
+
+    async def _pybossa_req(self, method, domain, id=None, payload=None):
+        """Send a JSON request like pbclient._pybossa_req does."""
+        url = self.endpoint + '/api/' + domain
+        if id is not None:
+            url += '/' + str(id)
+        params = dict()
+        if self.api_key:
+            params['api_key'] = self.api_key
+        headers = {'content-type': 'application/json'}
+        await self._wait()
+        try:
+            async with self.session.request(method, url, params=params,
+                                            headers=headers,
+                                            data=json.dumps(payload)) as r:
+                self.governor.observe(r)
+                text = await r.text()
+                retry_after = r.headers.get('Retry-After')
+        except aiohttp.ClientConnectionError as e:
+            # Callers handle the same error for both transports
+            raise exceptions.ConnectionError(e)
+        if r.status in RETRY_LATER_CODES and retry_after is not None:
+            # The server did not process the request, see RetryPolicy
+            return retry_later(r.status)
+        if r.status // 100 == 2 and (not text or text == '""'):
+            return True
+        return json.loads(text)
+
+    async def create_task(self, project_id, info, n_answers=30,
+                          priority_0=0, quorum=0):
+        """Create a task like pbclient.create_task."""
+        task = dict(project_id=project_id, info=info, calibration=0,
+                    priority_0=priority_0, n_answers=n_answers, quorum=quorum)
+        res = await self._pybossa_req('post', 'task', payload=task)
+        if res.get('id'):
+            return pbclient.Task(res)
+        return res
+
+    async def update_task(self, task):
+        """Update a task like pbclient.update_task."""
+        task_id = task.id
+        task = pbclient._forbidden_attributes(task)
+        res = await self._pybossa_req('put', 'task', task_id,
+                                      payload=task.data)
+        if res.get('id'):
+            return pbclient.Task(res)
+        return res
+
+    async def delete_task(self, task_id):
+        """Delete a task like pbclient.delete_task."""
+        res = await self._pybossa_req('delete', 'task', task_id)
+        if type(res).__name__ == 'bool':
+            return True
+        return res
+
+    def map(self, method, calls, retry=None, dead_letter=None,
+            on_response=None):
+        """Yield (tag, method(**kwargs)) for every (tag, kwargs) in calls.
+
+        At most limit requests are in flight. The responses are returned in
+        completion order. With a retry policy the transient failures are
+        retried, and the response is None for the calls sent to dead_letter.
+        on_response(tag, response), if given, is called as soon as each
+        response arrives.
+        """
+        self._start()
+        func = getattr(self, method)
+
+        async def call(tag, kwargs):
+            if retry is None:
+                response = await func(**kwargs)
+            else:
+                response = await retry.acall(method, func, kwargs,
+                                             dead_letter)
+            if on_response is not None:
+                on_response(tag, response)
+            return tag, response
+
+        calls = iter(calls)
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.limit:
+                    try:
+                        tag, kwargs = next(calls)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(self.loop.create_task(call(tag, kwargs)))
+                if not pending:
+                    break
+                done, pending = self.loop.run_until_complete(
+                    asyncio.wait(pending,
+                                 return_when=asyncio.FIRST_COMPLETED))
+                for future in done:
+                    yield future.result()
+        finally:
+            # The server may have already processed the requests in flight,
+            # so wait for them instead of cancelling them
+            if pending:
+                self.loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True))
@@ -23,59 +23,101 @@ This module exports the following methods:
     * check_api_errors: check for API errors returned by a PyBossa server.
     * format_error: format error message.
     * format_json_task: format a CSV row into JSON.
+    * RateLimitGovernor: pace API writes using the server rate-limit headers.
+    * ProjectCache: remember the projects found by short_name between runs.
+    * EXPORT_KINDS: the records pbs can export.
+    * ExportMark: remember the last record of an incremental export.
+    * create_mirror: return the local SQLite mirror of a server.
 """
 import re
+import io
+import copy
 import os
+import sys
 import csv
 import json
 import time
 import click
 import datetime
-from io import StringIO
-import polib
-import openpyxl
 import itertools
 from requests import exceptions
 import requests
 from pbsexceptions import *
+from pbsretry import (DeadLetter, RETRY_LATER_CODES,
+                      status_code, retry_later)
+from pbsmirror import Mirror
 import logging
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
 import calendar
+import hashlib
+import threading
+import email.utils
+import fnmatch
+import collections
+from concurrent import futures
 
 
 __all__ = ['find_project_by_short_name', 'check_api_error',
            'format_error', 'format_json_task', '_create_project',
-           '_update_project', '_add_tasks', 'create_task_info',
+           '_update_project', '_add_tasks', 'Failure', 'create_task_info',
            '_delete_tasks', 'enable_auto_throttling',
            '_update_tasks_redundancy',
            '_update_project_watch', 'PbsHandler',
            '_update_task_presenter_bundle_js', 'row_empty',
-           '_add_helpingmaterials', 'create_helping_material_info']
+           '_add_helpingmaterials', 'create_helping_material_info',
+           'RateLimitGovernor', 'create_session', 'TaskJournal',
+           'TaskIndex', 'task_hash', 'ProjectCache', 'create_project_cache',
+           'ProjectManifest', 'create_project_manifest',
+           'DebouncedUploader', '_watch_projects', '_load_project',
+           '_load_batch', '_run_batch', '_export', 'EXPORT_KINDS',
+           'ExportMark', 'create_mirror', '_update_mirror', '_aggregate']
+
+
+# Folder for the pbs files kept between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pbs')
+
+# Maximum number of records of a page of the PYBOSSA API
+MAX_PAGE_SIZE = 100
+
+# Records that can be exported, with their pbclient find_ and get_ functions
+EXPORT_KINDS = ('tasks', 'taskruns', 'results')
+
+
+class Failure(str):
+
+    """Message of a command that failed, e.g. with a connection error.
+
+    The commands report their errors in the message they return, and batch
+    uses its type to stop the operations of the project.
+    """
 
 
 def _create_project(config):
     """Create a project in a PyBossa server."""
     try:
-        response = config.pbclient.create_project(config.project['name'],
-                                                  config.project['short_name'],
-                                                  config.project['description'])
+        response = _call_api(config, 'create_project',
+                             config.project['name'],
+                             config.project['short_name'],
+                             config.project['description'])
         check_api_error(response)
+        _cache_project(config, response)
         return ("Project: %s created!" % config.project['short_name'])
     except exceptions.ConnectionError:
-        return("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except (ProjectNotFound, TaskNotFound):
         raise
 
 def _update_project_watch(config, task_presenter, results,
-                          long_description, tutorial):  # pragma: no cover
+                          long_description, tutorial,
+                          delay=0.5):  # pragma: no cover
     """Update a project in a loop."""
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(message)s',
                         datefmt='%Y-%m-%d %H:%M:%S')
     path = os.getcwd()
+    from watchdog.observers import Observer
     event_handler = PbsHandler(config, task_presenter, results,
-                               long_description, tutorial)
+                               long_description, tutorial, delay)
     observer = Observer()
     # We only want the current folder, not sub-folders
     observer.schedule(event_handler, path, recursive=False)
@@ -86,28 +128,275 @@ def _update_project_watch(config, task_presenter, results,
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    event_handler.uploader.close()
+
+def _watch_projects(config, root, delay=0.5):  # pragma: no cover
+    """Update every project under root in a loop."""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = _project_handlers(config, root, delay)
+    if not handlers:
+        return "No project.json found in %s" % root
+    from watchdog.observers import Observer
+    observer = Observer()
+    for folder, handler in handlers:
+        logging.info("Watching %s: %s", handler.config.project['short_name'],
+                     folder)
+        observer.schedule(handler, folder, recursive=False)
+    observer.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
+    observer.join()
+    for _, handler in handlers:
+        handler.uploader.close()
+
+
+def _project_handlers(config, root, delay=0.5):
+    """Return a (folder, PbsHandler) for every project.json under root.
+
+    The projects share the HTTP session of config. Each one has its own
+    uploader thread, so different projects are updated concurrently.
+    """
+    handlers = []
+    for folder in _find_project_folders(root):
+        try:
+            with open(os.path.join(folder, 'project.json')) as f:
+                project = _load_project(f)
+        except click.Abort:
+            click.secho("Skipping %s" % folder, fg='yellow')
+            continue
+        project_config = copy.copy(config)
+        project_config.project = project
+        handler = PbsHandler(project_config,
+                             os.path.join(folder, 'template.html'),
+                             os.path.join(folder, 'results.html'),
+                             os.path.join(folder, 'long_description.md'),
+                             os.path.join(folder, 'tutorial.html'),
+                             delay, folder)
+        handlers.append((folder, handler))
+    return handlers
+
+
+def _load_batch(manifest_file):
+    """Return the operations of a batch manifest file (JSON or YAML).
+
+    The manifest is a list of operations, or a mapping with the list in
+    operations. Every operation is a mapping with the path of a project.json
+    file, a pbs command and the options of the command.
+    """
+    import inspect
+    text = manifest_file.read()
+    if manifest_file.name.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise click.UsageError("YAML manifests need the pyyaml package: "
+                                   "pip install pybossa-pbs[yaml]")
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('operations')
+    if not isinstance(data, list):
+        raise click.UsageError("The manifest must have a list of operations")
+    for number, operation in enumerate(data, 1):
+        if not isinstance(operation, dict):
+            raise click.UsageError("Operation %s must be a mapping" % number)
+        options = dict(operation)
+        project = options.pop('project', 'project.json')
+        command = str(options.pop('command', '')).replace('-', '_')
+        func = _batch_commands.get(command)
+        if func is None:
+            raise click.UsageError("Operation %s: unknown command '%s'" %
+                                   (number, command))
+        try:
+            inspect.signature(func).bind(None, None, **options)
+        except TypeError as e:
+            raise click.UsageError("Operation %s: %s" % (number, e))
+        operation.update(project=project, command=command)
+    return data
+
+
+def _run_batch(config, operations, base='', workers=4):
+    """Run the operations of a batch, the projects in parallel.
+
+    The operations of a project run in order, and the first error stops the
+    rest of its operations. The projects share the HTTP session and the
+    project cache of config. Return the number of operations not done.
+    """
+    projects = dict()
+    for operation in operations:
+        path = os.path.join(base, operation['project'])
+        projects.setdefault(path, []).append(operation)
+    if config.async_client is not None:
+        # The asyncio client runs one event loop
+        workers = 1
+
+    def run(item):
+        return _run_project_batch(config, *item)
+
+    return sum(_bounded_map(run, projects.items(), workers))
+
+
+def _run_project_batch(config, path, operations):
+    """Run the operations of a project, return the number not done."""
+    folder = os.path.dirname(path)
+    try:
+        with open(path) as f:
+            project = _load_project(f)
+    except (IOError, click.Abort):
+        click.secho("Error: cannot load the project %s" % path, fg='red')
+        return len(operations)
+    project_config = copy.copy(config)
+    project_config.project = project
+    for done, operation in enumerate(operations):
+        command = operation['command']
+        options = dict((key, value) for key, value in operation.items()
+                       if key not in ('project', 'command'))
+        try:
+            res = _batch_commands[command](project_config, folder, **options)
+        except Exception as e:
+            res = Failure("Error: %s" % e)
+        if isinstance(res, Failure):
+            click.secho("%s %s: %s" % (project['short_name'], command, res),
+                        fg='red')
+            return len(operations) - done
+        click.echo("%s %s: %s" % (project['short_name'], command, res))
+    return 0
+
+
+def _batch_create_project(config, folder):
+    return _create_project(config)
+
+
+def _batch_update_project(config, folder, task_presenter='template.html',
+                          results='results.html',
+                          long_description='long_description.md',
+                          tutorial='tutorial.html', force=False):
+    if force:
+        config = copy.copy(config)
+        config.manifest = None
+    paths = [os.path.join(folder, path) for path in
+             (task_presenter, results, long_description, tutorial)]
+    return _update_project(config, *paths, bundle_dir=folder)
+
+
+def _batch_add_tasks(config, folder, tasks_file, tasks_type=None, priority=0,
+                     redundancy=30, workers=1, sheet=None, resume=False,
+                     dedup=False, dead_letter='failed_tasks.jsonl'):
+    with open(os.path.join(folder, tasks_file)) as f:
+        return _add_tasks(config, f, tasks_type, priority, redundancy,
+                          workers, sheet, resume, dedup=dedup,
+                          dead_letter=os.path.join(folder, dead_letter))
+
 
-def _update_task_presenter_bundle_js(project):
-    """Append to template a distribution bundle js."""
-    if os.path.isfile ('bundle.min.js'):
-        with open('bundle.min.js') as f:
+def _batch_add_helpingmaterials(config, folder, helping_materials_file,
+                                helping_type=None, sheet=None):
+    with open(os.path.join(folder, helping_materials_file)) as f:
+        return _add_helpingmaterials(config, f, helping_type, sheet)
+
+
+def _batch_delete_tasks(config, folder, task_id=None, workers=1):
+    return _delete_tasks(config, task_id, workers=workers)
+
+
+def _batch_update_task_redundancy(config, folder, redundancy, task_id=None,
+                                  workers=1, bulk=False,
+                                  only_incomplete=False, min_id=None,
+                                  max_id=None):
+    return _update_tasks_redundancy(config, task_id, redundancy,
+                                    workers=workers, bulk=bulk,
+                                    only_incomplete=only_incomplete,
+                                    min_id=min_id, max_id=max_id)
+
+
+# Commands of the batch manifests: f(config, project folder, **options)
+_batch_commands = {
+    'create_project': _batch_create_project,
+    'update_project': _batch_update_project,
+    'add_tasks': _batch_add_tasks,
+    'add_helpingmaterials': _batch_add_helpingmaterials,
+    'delete_tasks': _batch_delete_tasks,
+    'update_task_redundancy': _batch_update_task_redundancy,
+}
+
+
+def _find_project_folders(root):
+    """Yield the folders under root with a project.json file."""
+    for folder, dirs, files in os.walk(root):
+        # Skip hidden folders and installed JavaScript packages
+        dirs[:] = sorted(d for d in dirs
+                         if not d.startswith('.') and d != 'node_modules')
+        if 'project.json' in files:
+            yield folder
+
+
+def _load_project(project_file):
+    """Return the project of a project.json file, checking its format."""
+    import jsonschema
+    try:
+        project = json.loads(project_file.read())
+    except json.JSONDecodeError as e:
+        click.secho("Error: invalid JSON format in project.json:", fg='red')
+        if e.msg == 'Expecting value':
+            e.msg += " (if string enclose it with double quotes)"
+        click.echo("%s\n%s: line %s column %s" % (e.doc, e.msg, e.lineno, e.colno))
+        raise click.Abort()
+    try:
+        project_schema = {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "short_name": {"type": "string"},
+                "description": {"type": "string"}
+            }
+        }
+        jsonschema.validate(project, project_schema)
+    except jsonschema.exceptions.ValidationError as e:
+        click.secho("Error: invalid type in project.json", fg='red')
+        click.secho("'%s': %s" % (e.path[0], e.message), fg='yellow')
+        click.echo("'%s' must be a %s" % (e.path[0], e.validator_value))
+        raise click.Abort()
+    return project
+
+
+def _update_task_presenter_bundle_js(project, path=''):
+    """Append to template a distribution bundle js found in path."""
+    bundle_min_js = os.path.join(path, 'bundle.min.js')
+    if os.path.isfile (bundle_min_js):
+        with open(bundle_min_js) as f:
             js = f.read()
         project.info['task_presenter'] += "<script>\n%s\n</script>" % js
         return
 
-    if os.path.isfile ('bundle.js'):
-        with open('bundle.js') as f:
+    bundle_js = os.path.join(path, 'bundle.js')
+    if os.path.isfile (bundle_js):
+        with open(bundle_js) as f:
             js = f.read()
         project.info['task_presenter'] += "<script>\n%s\n</script>" % js
 
 def _update_project(config, task_presenter, results,
-                    long_description, tutorial):
-    """Update a project."""
+                    long_description, tutorial, bundle_dir=''):
+    """Update a project.
+
+    If config has a ProjectManifest only the fields that changed since the
+    last update are sent, and nothing is sent if none changed. Otherwise
+    the whole project is sent, so it is read from the server instead of the
+    project cache to keep the changes made since then. The bundle js files
+    are read from bundle_dir.
+    """
     try:
+        manifest = config.manifest
         # Get project
-        project = find_project_by_short_name(config.project['short_name'],
-                                             config.pbclient,
-                                             config.all)
+        if manifest is not None:
+            project = _find_project(config)
+        else:
+            project = find_project_by_short_name(config.project['short_name'],
+                                                 config.pbclient, config.all)
         # Update attributes
         project.name = config.project['name']
         project.short_name = config.project['short_name']
@@ -118,235 +407,1092 @@ def _update_project(config, task_presenter, results,
         # Update task presenter
         with open(task_presenter, 'r') as f:
             project.info['task_presenter'] = f.read()
-        _update_task_presenter_bundle_js(project)
+        _update_task_presenter_bundle_js(project, bundle_dir)
         # Update results
         with open(results, 'r') as f:
             project.info['results'] = f.read()
         # Update tutorial
         with open(tutorial, 'r') as f:
             project.info['tutorial'] = f.read()
-        response = config.pbclient.update_project(project)
+        project_id = project.id
+        if manifest is not None:
+            fields = _project_fields(project)
+            changed = manifest.changed(project_id, fields)
+            if not changed:
+                return ("Project %s is up to date" %
+                        config.project['short_name'])
+            project = _partial_project(config, project_id, fields, changed)
+        response = _call_api(config, 'update_project', project)
         check_api_error(response)
+        if manifest is not None:
+            manifest.update(project_id, fields)
+        # Keep the cached project in sync with the server
+        _cache_project(config, response)
         return ("Project %s updated!" % config.project['short_name'])
     except exceptions.ConnectionError:
-        return ("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except ProjectNotFound:
-        return ("Project not found! The project: %s is missing." \
+        # The cached project may have been deleted from the server
+        cache = config.project_cache
+        if cache is not None:
+            cache.remove(config.project['short_name'])
+        return Failure("Project not found! The project: %s is missing." \
                 " Use the flag --all=1 to search in all the server " \
                 % config.project['short_name'])
     except TaskNotFound:
         raise
 
 
-def _load_data(data_file, data_type):
-    """Load data from CSV, JSON, Excel, ..., formats."""
+def _project_fields(project):
+    """Return the fields of a project set by update_project, info flattened."""
+    fields = dict(name=project.name, short_name=project.short_name,
+                  description=project.description,
+                  long_description=project.long_description)
+    for key in ('task_presenter', 'results', 'tutorial'):
+        fields['info.' + key] = project.info[key]
+    return fields
+
+
+def _partial_project(config, project_id, fields, changed):
+    """Return a project with only the changed fields.
+
+    The server keeps the info keys that are not sent.
+    """
+    data = dict(id=project_id)
+    info = dict()
+    for key in changed:
+        if key.startswith('info.'):
+            info[key[len('info.'):]] = fields[key]
+        else:
+            data[key] = fields[key]
+    if info:
+        data['info'] = info
+    return config.pbclient.Project(data)
+
+
+def _load_data(data_file, data_type, sheet=None, offset=0):
+    """Return an iterator over the rows of a CSV, JSON, Excel, ..., file.
+
+    The rows are read lazily, so the file is never loaded in memory at once.
+    sheet selects the sheets of Excel files (see _load_excel). The line based
+    formats (CSV, JSON Lines and PROPERTIES) of seekable files start reading
+    at the byte offset of a row, and keep the offset of the next row in the
+    offset attribute of the returned iterator (None for the other formats).
+    """
     if data_type is None:
         data_type = data_file.name.split('.')[-1]
-    # Data list to process
-    data = []
-    # JSON type
-    if data_type == 'json':
-        raw_data = data_file.read()
-        data = json.loads(raw_data)
-        return data
-    # CSV type
-    elif data_type == 'csv':
-        raw_data = data_file.read()
-        csv_data = StringIO(raw_data)
-        reader = csv.DictReader(csv_data, delimiter=',')
-        for line in reader:
-            data.append(line)
-        return data
-    elif data_type in ['xlsx', 'xlsm', 'xltx', 'xltm']:
-        wb = openpyxl.load_workbook(data_file)
-        ws = wb.active
-        # First headers
-        headers = []
-        for row in ws.iter_rows(max_row=1):
-            for cell in row:
-                tmp = '_'.join(cell.value.split(" ")).lower()
-                headers.append(tmp)
-        # Simulate DictReader
-        for row in ws.iter_rows(min_row=2):
-            values = []
-            for cell in row:
-                values.append(cell.value)
-            tmp = dict(list(zip(headers, values)))
-            if len(values) == len(headers) and not row_empty(values):
-                data.append(tmp)
-        return data
-    # PO type
-    elif data_type == 'po':
-        raw_data = data_file.read()
-        po = polib.pofile(raw_data)
-        for entry in po.untranslated_entries():
-            data.append(entry.__dict__)
-        return data
-    # PROPERTIES type (used in Java and Firefox extensions)
-    elif data_type == 'properties':
-        raw_data = data_file.read()
-        lines = raw_data.split('\n')
-        for l in lines:
-            if l:
-                var_id, string = l.split('=')
-                tmp = dict(var_id=var_id, string=string)
-                data.append(tmp)
-        return data
-    else:
-        return data
+    if data_type in _excel_types:
+        return _Rows(_load_excel(data_file, sheet))
+    if data_type in _line_loaders:
+        lines = _LineReader(data_file, offset)
+        return _Rows(_line_loaders[data_type](lines), lines)
+    loader = _loaders.get(data_type)
+    if loader is None:
+        return _Rows(iter([]))
+    return _Rows(loader(data_file))
+
+
+class _Rows(object):
+
+    """Iterator over the rows of a tasks file (see _load_data)."""
+
+    def __init__(self, rows, lines=None):
+        """Init method."""
+        self._rows = rows
+        self._lines = lines
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    @property
+    def offset(self):
+        """Return the byte offset of the next row, or None if unknown."""
+        if self._lines is None:
+            return None
+        return self._lines.offset
+
+
+class _LineReader(object):
+
+    """Iterate over the lines of a text file keeping track of their offset.
+
+    Seekable files are read from their binary buffer, so offset is the byte
+    offset of the next line. Other files are iterated as they are, and
+    offset is None.
+    """
+
+    def __init__(self, data_file, offset=0):
+        """Init method."""
+        self.data_file = data_file
+        self.raw = _binary_file(data_file)
+        self.offset = offset if self.raw is not None else None
+        self.encoding = getattr(data_file, 'encoding', None) or 'utf-8'
+
+    def first_line(self):
+        """Return the first line of the file."""
+        if self.raw is None:
+            return next(iter(self.data_file), '')
+        self.raw.seek(0)
+        return self.raw.readline().decode(self.encoding)
+
+    def __iter__(self):
+        if self.raw is None:
+            for line in self.data_file:
+                yield line
+            return
+        self.raw.seek(self.offset)
+        for line in self.raw:
+            self.offset += len(line)
+            yield line.decode(self.encoding)
+
+
+def _binary_file(data_file):
+    """Return the seekable binary file behind data_file, or None."""
+    raw = getattr(data_file, 'buffer', data_file)
+    if isinstance(raw, io.BufferedIOBase) and raw.seekable():
+        return raw
+    return None
+
 
+def _load_json(data_file, chunk_size=65536):
+    """Yield the items of a JSON array without parsing the file at once.
 
-def _add_tasks(config, tasks_file, tasks_type, priority, redundancy):
-    """Add tasks to a project."""
+    The file is read in chunks and every item is decoded as soon as it is
+    complete, so only one item is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = data_file.read(chunk_size)
+    eof = not buf
+    pos = _skip_json_whitespace(buf, 0)
+    while pos == len(buf) and not eof:
+        chunk = data_file.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        pos = _skip_json_whitespace(buf, pos)
+    if buf[pos:pos + 1] != '[':
+        # Not an array, fall back to parse the whole document
+        for row in json.loads(buf + data_file.read()):
+            yield row
+        return
+    pos += 1
+    expect_item = True
+    while True:
+        pos = _skip_json_whitespace(buf, pos)
+        if pos < len(buf):
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',' and not expect_item:
+                expect_item = True
+                pos += 1
+                continue
+            try:
+                row, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = None
+            # A number at the end of the buffer may continue in the next chunk
+            if end is not None and (end < len(buf) or eof):
+                yield row
+                expect_item = False
+                pos = end
+                continue
+        if eof:
+            raise ValueError("Invalid JSON array: unexpected end of file")
+        chunk = data_file.read(chunk_size)
+        eof = not chunk
+        # Drop what has been already decoded
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def _skip_json_whitespace(buf, pos):
+    """Return the position of the first non whitespace char from pos."""
+    while pos < len(buf) and buf[pos] in ' \t\n\r':
+        pos += 1
+    return pos
+
+
+def _load_json_lines(lines):
+    """Yield the rows of a JSON Lines file, one JSON document per line."""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _load_csv(lines):
+    """Yield the rows of a CSV file."""
+    fieldnames = None
+    if lines.offset:
+        # Resuming after the first row: the headers are in the first line
+        fieldnames = next(csv.reader([lines.first_line()], delimiter=','))
+    reader = csv.DictReader(lines, fieldnames=fieldnames, delimiter=',')
+    for line in reader:
+        yield line
+
+
+def _load_excel(data_file, sheet=None):
+    """Yield the rows of an Excel file as dicts.
+
+    The workbook is opened in read-only mode, so the rows are read from the
+    file as they are needed. sheet is the name of the sheet to load (the
+    active one by default), or '*' to load every sheet.
+    """
+    import openpyxl
+    # openpyxl needs a binary file
+    wb = openpyxl.load_workbook(getattr(data_file, 'buffer', data_file),
+                                read_only=True, data_only=True)
     try:
-        project = find_project_by_short_name(config.project['short_name'],
-                                             config.pbclient,
-                                             config.all)
-        data = _load_data(tasks_file, tasks_type)
-        if len(data) == 0:
-            return ("Unknown format for the tasks file. Use json, csv, po or "
-                    "properties.")
-        # If true, warn user
-        # if sleep:  # pragma: no cover
-        #     click.secho(msg, fg='yellow')
-        # Show progress bar
-        with click.progressbar(data, label="Adding Tasks") as pgbar:
-            for d in pgbar:
+        if sheet == '*':
+            worksheets = wb.worksheets
+        elif sheet:
+            if sheet not in wb.sheetnames:
+                raise click.BadParameter("%s is not a sheet of the file, use "
+                                         "one of: %s" %
+                                         (sheet, ', '.join(wb.sheetnames)),
+                                         param_hint='"--sheet"')
+            worksheets = [wb[sheet]]
+        else:
+            worksheets = [wb.active]
+        for ws in worksheets:
+            for row in _load_worksheet(ws):
+                yield row
+    finally:
+        wb.close()
+
+
+def _load_worksheet(ws):
+    """Yield the rows of a worksheet as dicts keyed by its first row."""
+    rows = ws.iter_rows(values_only=True)
+    headers = None
+    for values in rows:
+        if headers is None:
+            headers = [_excel_header(value) for value in values]
+            continue
+        # Ignore cells outside of the headers, and fill the missing ones
+        values = list(values[:len(headers)])
+        values += [None] * (len(headers) - len(values))
+        if not row_empty(values):
+            yield dict(zip(headers, values))
+
+
+def _excel_header(value):
+    """Return a column name as a lowercase identifier."""
+    if value is None:
+        return ''
+    return '_'.join(str(value).split(" ")).lower()
+
+
+def _load_po(data_file):
+    """Yield the untranslated entries of a PO file."""
+    import polib
+    raw_data = data_file.read()
+    po = polib.pofile(raw_data)
+    for entry in po.untranslated_entries():
+        yield entry.__dict__
+
+
+def _load_properties(lines):
+    """Yield the strings of a PROPERTIES file (used in Java and Firefox)."""
+    for l in lines:
+        l = l.rstrip('\r\n')
+        if l:
+            var_id, string = l.split('=')
+            yield dict(var_id=var_id, string=string)
+
+
+_loaders = {'json': _load_json,
+            'po': _load_po}
+
+
+_line_loaders = {'jsonl': _load_json_lines,
+                 'ndjson': _load_json_lines,
+                 'csv': _load_csv,
+                 'properties': _load_properties}
+
+
+_excel_types = ['xlsx', 'xlsm', 'xltx', 'xltm']
+
+
+def _peek(iterator):
+    """Return the iterator unchanged, or None if it is empty."""
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return None
+    return itertools.chain([first], iterator)
+
+
+def _progressbar(iterable, label, length=None):
+    """Return a progress bar that shows the throughput if length is unknown."""
+    def show_rate(item):
+        if bar.length_known or not bar.pos:
+            return None
+        return '%.1f/s' % (1 / (bar.time_per_iteration or 1))
+
+    bar = click.progressbar(iterable, length=length, label=label,
+                            show_pos=True, item_show_func=show_rate)
+    return bar
+
+
+def _add_tasks(config, tasks_file, tasks_type, priority, redundancy,
+               workers=1, sheet=None, resume=False, journal_dir=None,
+               dedup=False, index_dir=None, dead_letter=None):
+    """Add tasks to a project.
+
+    The tasks that cannot be created after the retries are written to the
+    dead_letter file, if given, instead of stopping the import.
+    """
+    try:
+        project = _find_project(config)
+        journal = _open_task_journal(config, tasks_file, journal_dir)
+        start, offset = 0, 0
+        if journal is not None and (journal.rows or journal.created):
+            if resume:
+                start, offset = journal.rows, journal.offset
+                click.echo("Resuming from row %s" % start)
+            else:
+                click.secho("Warning: a previous import of this file did not "
+                            "finish. Use --resume to continue it.", fg='yellow')
+                journal.reset()
+        index = None
+        if dedup:
+            index = _open_task_index(config, project, index_dir)
+        rows = _load_data(tasks_file, tasks_type, sheet, offset or 0)
+        if start and (offset is None or rows.offset is None):
+            # The file cannot be sought, skip the rows already created
+            rows = _Rows(itertools.islice(rows, start, None), rows)
+        data = _peek(rows)
+        if data is None and start:
+            journal.remove()
+            return ("0 tasks added to project: %s" %
+                    config.project['short_name'])
+        if data is None:
+            return Failure("Unknown format for the tasks file. Use json, csv, "
+                           "po or properties.")
+
+        skipped = [0]
+
+        def calls():
+            scheduled = set()
+            for index_row, d in enumerate(data, start):
+                if journal is not None and index_row in journal.created:
+                    # Created after a failed row by the interrupted import
+                    journal.done(index_row, rows.offset)
+                    continue
                 task_info = create_task_info(d)
-                response = config.pbclient.create_task(project_id=project.id,
-                                                       info=task_info,
-                                                       n_answers=redundancy,
-                                                       priority_0=priority)
+                digest = None
+                if index is not None:
+                    digest = task_hash(task_info)
+                    if digest in index or digest in scheduled:
+                        skipped[0] += 1
+                        if journal is not None:
+                            journal.done(index_row, rows.offset)
+                        continue
+                    scheduled.add(digest)
+                tag = (index_row, rows.offset, digest)
+                yield tag, dict(project_id=project.id, info=task_info,
+                                n_answers=redundancy, priority_0=priority)
 
-                # Check if for the data we have to auto-throttle task creation
-                sleep, msg = enable_auto_throttling(config, data)
-                check_api_error(response)
-                # If auto-throttling enabled, sleep for sleep seconds
-                if sleep:  # pragma: no cover
-                    time.sleep(sleep)
-            return ("%s tasks added to project: %s" % (len(data),
-                    config.project['short_name']))
+        def sent(tag, response):
+            # Record the row as soon as it is sent, even if the import stops
+            # before its response is read. The failed rows are kept in the
+            # dead letter file.
+            if journal is not None and not _api_error(response):
+                journal.done(tag[0], tag[1])
+
+        # Show progress bar
+        added = 0
+        failed = None
+        if dead_letter is not None:
+            failed = DeadLetter(dead_letter)
+        responses = _send_requests(config, 'create_task', calls(), workers,
+                                   failed, on_response=sent)
+        try:
+            with _progressbar(responses, "Adding Tasks") as pgbar:
+                for (index_row, row_offset, digest), response in pgbar:
+                    if response is None:
+                        continue
+                    added += 1
+                    if index is not None:
+                        index.add(digest)
+        except BaseException:
+            # Wait for the rows in flight, they may be created in the server
+            responses.close()
+            if journal is not None:
+                journal.save()
+            raise
+        finally:
+            if index is not None:
+                index.save()
+            if failed is not None:
+                failed.close()
+        if journal is not None:
+            journal.remove()
+        msg = "%s tasks added to project: %s" % (added,
+                                                 config.project['short_name'])
+        if index is not None:
+            msg += " (%s already in the project skipped)" % skipped[0]
+        if failed is not None and failed.count:
+            msg += ". %s tasks failed and were saved in %s" % (failed.count,
+                                                              dead_letter)
+        return msg
     except exceptions.ConnectionError:
-        return ("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except (ProjectNotFound, TaskNotFound):
         raise
 
 
-def _add_helpingmaterials(config, helping_file, helping_type):
+def _open_task_journal(config, tasks_file, journal_dir=None):
+    """Return the TaskJournal of tasks_file, or None if it has no journal."""
+    fingerprint = _fingerprint(tasks_file)
+    if fingerprint is None:
+        return None
+    journal_dir = journal_dir or os.path.join(CACHE_DIR, 'journal')
+    path = os.path.join(journal_dir, '%s-%s-%s.json' %
+                        (_server_key(config.server),
+                         config.project['short_name'], fingerprint))
+    return TaskJournal(path, fingerprint)
+
+
+def _open_task_index(config, project, index_dir=None):
+    """Return the TaskIndex of project, updated with the new server tasks.
+
+    With config.refresh the index is built again from all the server tasks,
+    e.g. to forget the tasks changed or deleted in the server.
+    """
+    index = TaskIndex(_task_index_path(config, project.id, index_dir),
+                      load=not config.refresh)
+    for task in _iter_tasks(config, project.id, last_id=index.last_id):
+        index.add(task_hash(task.info))
+        index.last_id = max(index.last_id or 0, task.id)
+    index.save()
+    return index
+
+
+def _task_index_path(config, project_id, index_dir=None):
+    """Return the path of the TaskIndex of a project in the server."""
+    index_dir = index_dir or os.path.join(CACHE_DIR, 'index')
+    return os.path.join(index_dir, '%s-%s.json' % (_server_key(config.server),
+                                                   project_id))
+
+
+def _iter_tasks(config, project_id, limit=100, last_id=None):
+    """Yield the tasks of a project paging by the id of the last task."""
+    return _iter_records(config, 'get_tasks', project_id, limit, last_id)
+
+
+def _iter_records(config, getter, project_id, limit=100, last_id=None):
+    """Yield the records of a project paging by the id of the last record.
+
+    Paging by id is fast for any page and it is not affected by records being
+    deleted meanwhile. The next page is requested on a background thread
+    while the current one is being processed. The server may return fewer
+    records than limit (PYBOSSA caps it at MAX_PAGE_SIZE), so only an empty
+    page ends the records.
+    """
+    get = getattr(config.pbclient, getter)
+
+    def get_page(last_id):
+        records = get(project_id, limit=limit, last_id=last_id or 0)
+        check_api_error(records)
+        return records
+
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+        page = executor.submit(get_page, last_id)
+        while page is not None:
+            records = page.result()
+            page = None
+            if records:
+                page = executor.submit(get_page, records[-1].id)
+            for record in records:
+                yield record
+
+
+def _iter_pages(config, finder, project_id, limit=100, workers=4):
+    """Yield the records of a project fetching up to workers pages at once.
+
+    The pages are requested by offset so they can be fetched concurrently,
+    and the records are yielded in order. At most workers pages are kept in
+    memory. The offsets need the real size of the pages, so limit is capped
+    to the MAX_PAGE_SIZE of the server.
+    """
+    find = getattr(config.pbclient, finder)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    def get_page(offset):
+        records = find(project_id, limit=limit, offset=offset, orderby='id')
+        if not isinstance(records, list):
+            check_api_error(records)
+        return records
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = collections.deque(executor.submit(get_page, n * limit)
+                                  for n in range(workers))
+        offset = workers * limit
+        while pages:
+            records = pages.popleft().result()
+            if len(records) < limit:
+                # A short page is the last one
+                for page in pages:
+                    page.cancel()
+                pages.clear()
+            else:
+                pages.append(executor.submit(get_page, offset))
+                offset += limit
+            for record in records:
+                yield record
+
+
+def task_hash(task_info):
+    """Return a stable hash of the info of a task."""
+    data = json.dumps(task_info, sort_keys=True, separators=(',', ':'),
+                      default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _fingerprint(data_file, sample=1 << 20):
+    """Return a hash of the size, first and last MB of a file, or None.
+
+    Sampling the file keeps the hash cheap for very large files.
+    """
+    raw = _binary_file(data_file)
+    if raw is None:
+        return None
+    pos = raw.tell()
+    size = raw.seek(0, os.SEEK_END)
+    digest = hashlib.sha1(str(size).encode('utf-8'))
+    raw.seek(0)
+    digest.update(raw.read(sample))
+    raw.seek(max(size - sample, 0))
+    digest.update(raw.read(sample))
+    raw.seek(pos)
+    return digest.hexdigest()
+
+
+def _add_helpingmaterials(config, helping_file, helping_type, sheet=None):
     """Add helping materials to a project."""
     try:
-        project = find_project_by_short_name(config.project['short_name'],
-                                             config.pbclient,
-                                             config.all)
-        data = _load_data(helping_file, helping_type)
-        if len(data) == 0:
-            return ("Unknown format for the tasks file. Use json, csv, po or "
-                    "properties.")
+        project = _find_project(config)
+        data = _peek(_load_data(helping_file, helping_type, sheet))
+        if data is None:
+            return Failure("Unknown format for the tasks file. Use json, csv, "
+                           "po or properties.")
         # Show progress bar
-        with click.progressbar(data, label="Adding Helping Materials") as pgbar:
+        added = 0
+        with _progressbar(data, "Adding Helping Materials") as pgbar:
             for d in pgbar:
                 helping_info, file_path = create_helping_material_info(d)
                 if file_path:
                     # Create first the media object
-                    hm = config.pbclient.create_helpingmaterial(project_id=project.id,
-                                                                info=helping_info,
-                                                                file_path=file_path)
+                    hm = _call_api(config, 'create_helpingmaterial',
+                                   verbose=True, project_id=project.id, info=helping_info,
+                                   file_path=file_path)
                     check_api_error(hm)
 
                     z = hm.info.copy()
                     z.update(helping_info)
                     hm.info = z
-                    response = config.pbclient.update_helping_material(hm)
+                    response = _call_api(config, 'update_helping_material',
+                                         hm, verbose=True)
                     check_api_error(response)
                 else:
-                    response = config.pbclient.create_helpingmaterial(project_id=project.id,
-                                                                      info=helping_info)
+                    response = _call_api(config, 'create_helpingmaterial',
+                                         verbose=True, project_id=project.id,
+                                         info=helping_info)
                 check_api_error(response)
-                # Check if for the data we have to auto-throttle task creation
-                sleep, msg = enable_auto_throttling(config, data,
-                                                    endpoint='/api/helpinmaterial')
-                # If true, warn user
-                if sleep:  # pragma: no cover
-                    click.secho(msg, fg='yellow')
-                # If auto-throttling enabled, sleep for sleep seconds
-                if sleep:  # pragma: no cover
-                    time.sleep(sleep)
-            return ("%s helping materials added to project: %s" % (len(data),
+                added += 1
+            return ("%s helping materials added to project: %s" % (added,
                     config.project['short_name']))
     except exceptions.ConnectionError:
-        return ("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except (ProjectNotFound, TaskNotFound):
         raise
 
 
 
-def _delete_tasks(config, task_id, limit=100, offset=0):
+def _delete_tasks(config, task_id, limit=100, last_id=None, workers=1,
+                  from_mirror=False):
     """Delete tasks from a project."""
     try:
-        project = find_project_by_short_name(config.project['short_name'],
-                                             config.pbclient,
-                                             config.all)
+        project = _find_project(config)
+        mirror = config.mirror
+        # The tasks index of the project is no longer valid
+        TaskIndex(_task_index_path(config, project.id), load=False).remove()
         if task_id:
-            response = config.pbclient.delete_task(task_id)
+            response = _call_api(config, 'delete_task', task_id=task_id)
             check_api_error(response)
+            if mirror is not None:
+                mirror.remove_tasks(project.id, [int(task_id)])
             return "Task.id = %s and its associated task_runs have been deleted" % task_id
         else:
-            limit = limit
-            offset = offset
-            tasks = config.pbclient.get_tasks(project.id, limit, offset)
-            while len(tasks) > 0:
-                for t in tasks:
-                    response = config.pbclient.delete_task(t.id)
-                    check_api_error(response)
-                offset += limit
-                tasks = config.pbclient.get_tasks(project.id, limit, offset)
+            tasks = _project_tasks(config, project, limit, last_id,
+                                   from_mirror)
+            calls = ((t.id, dict(task_id=t.id)) for t in tasks)
+            # The mirror may have tasks already deleted in the server
+            responses = _send_requests(config, 'delete_task', calls, workers,
+                                       missing_ok=from_mirror)
+            deleted = []
+            # Show the number of deleted tasks and the tasks per second
+            with _progressbar(responses, "Deleting Tasks") as pgbar:
+                for tag, response in pgbar:
+                    if mirror is not None and (response is True or
+                                               status_code(response) == 404):
+                        deleted.append(tag)
+            if mirror is not None:
+                mirror.remove_tasks(project.id, deleted)
             return "All tasks and task_runs have been deleted"
     except exceptions.ConnectionError:
-        return ("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except (ProjectNotFound, TaskNotFound):
         raise
 
 
-def _update_tasks_redundancy(config, task_id, redundancy, limit=300, offset=0):
+def _update_tasks_redundancy(config, task_id, redundancy, limit=100,
+                             last_id=None, workers=1, bulk=False,
+                             only_incomplete=False, min_id=None, max_id=None,
+                             from_mirror=False):
     """Update tasks redundancy from a project."""
     try:
-        project = find_project_by_short_name(config.project['short_name'],
-                                             config.pbclient,
-                                             config.all)
+        project = _find_project(config)
+        mirror = config.mirror
         if task_id:
             response = config.pbclient.find_tasks(project.id, id=task_id)
             check_api_error(response)
             task = response[0]
             task.n_answers = redundancy
-            response = config.pbclient.update_task(task)
+            response = _call_api(config, 'update_task', task=task)
             check_api_error(response)
+            if mirror is not None and redundancy is not None:
+                mirror.set_n_answers(project.id, int(redundancy),
+                                     [int(task_id)])
             msg = "Task.id = %s redundancy has been updated to %s" % (task_id,
                                                                       redundancy)
             return msg
         else:
-            limit = limit
-            offset = offset
-            tasks = config.pbclient.get_tasks(project.id, limit, offset)
-            with click.progressbar(tasks, label="Updating Tasks") as pgbar:
-                while len(tasks) > 0:
-                    for t in pgbar:
-                        t.n_answers = redundancy
-                        response = config.pbclient.update_task(t)
-                        check_api_error(response)
-                        # Check if for the data we have to auto-throttle task update
-                        sleep, msg = enable_auto_throttling(config, tasks)
-                        # If auto-throttling enabled, sleep for sleep seconds
-                        if sleep:  # pragma: no cover
-                            time.sleep(sleep)
-                    offset += limit
-                    tasks = config.pbclient.get_tasks(project.id, limit, offset)
+            filtered = only_incomplete or min_id or max_id
+            # The bulk update cannot filter the tasks
+            if (bulk and not filtered and
+                    _bulk_update_redundancy(config, project, redundancy)):
+                if mirror is not None:
+                    mirror.set_n_answers(project.id, int(redundancy))
                 return "All tasks redundancy have been updated"
+            if min_id:
+                last_id = max(last_id or 0, int(min_id) - 1)
+            tasks = _project_tasks(config, project, limit, last_id,
+                                   from_mirror)
+            counts = dict(planned=0, skipped=0)
+            # The plan is streamed, so the updates start with the first page
+            plan = _plan_redundancy_updates(tasks, redundancy, counts,
+                                            only_incomplete, max_id)
+
+            def calls():
+                for t in plan:
+                    # Only send the redundancy, the other fields may have
+                    # changed in the server since the tasks were read
+                    task = config.pbclient.Task(dict(id=t.id,
+                                                     n_answers=redundancy))
+                    yield t.id, dict(task=task)
+
+            # The mirror may have tasks already deleted in the server
+            responses = _send_requests(config, 'update_task', calls(),
+                                       workers, missing_ok=from_mirror)
+            updated = []
+            deleted = []
+            with _progressbar(responses, "Updating Tasks") as pgbar:
+                for tag, response in pgbar:
+                    if response is None:
+                        continue
+                    if status_code(response) == 404:
+                        deleted.append(tag)
+                    elif status_code(response) is None:
+                        updated.append(tag)
+            if mirror is not None:
+                mirror.remove_tasks(project.id, deleted)
+                if redundancy is not None:
+                    mirror.set_n_answers(project.id, int(redundancy), updated)
+            return ("%s tasks redundancy updated (%s planned, %s skipped)" %
+                    (len(updated), counts['planned'], counts['skipped']))
+    except exceptions.ConnectionError:
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
+    except (ProjectNotFound, TaskNotFound):
+        raise
+
+
+def _plan_redundancy_updates(tasks, redundancy, counts, only_incomplete=False,
+                             max_id=None):
+    """Yield the tasks whose redundancy changes.
+
+    The tasks that already have the redundancy, the completed ones (with
+    only_incomplete) and the ones after max_id are skipped. The planned and
+    skipped tasks are counted in counts as they are read.
+    """
+    for t in tasks:
+        # The tasks come sorted by id
+        if max_id and t.id > int(max_id):
+            return
+        if ((redundancy is not None and t.n_answers == int(redundancy)) or
+                (only_incomplete and t.state == 'completed')):
+            counts['skipped'] += 1
+            continue
+        counts['planned'] += 1
+        yield t
+
+
+def _bulk_update_redundancy(config, project, redundancy):
+    """Update the redundancy of all the tasks of a project in one request.
+
+    It uses the redundancy update form of the PYBOSSA web interface, which is
+    protected against CSRF: its token is read from the form with the same
+    session (and cookies) before sending it. Return False if the server does
+    not support it.
+    """
+    if redundancy is None:
+        return False
+    url = '%s/project/%s/tasks/redundancyupdate' % (config.server,
+                                                    project.short_name)
+    params = dict(api_key=config.api_key)
+    # PYBOSSA answers the forms in JSON for JSON requests
+    headers = {'Accept': 'application/json',
+               'Content-Type': 'application/json'}
+    config.governor.wait()
+    form = _json_response(config.session.get(url, params=params,
+                                             headers=headers))
+    if not isinstance(form, dict) or not isinstance(form.get('form'), dict):
+        return False
+    csrf = form['form'].get('csrf')
+    if csrf:
+        headers['X-CSRFToken'] = csrf
+    config.governor.wait()
+    data = _json_response(config.session.post(
+        url, params=params, json=dict(n_answers=int(redundancy)),
+        headers=headers))
+    return isinstance(data, dict) and data.get('status') == 'success'
+
+
+def _json_response(response):
+    """Return the JSON of a successful response, or None."""
+    if response.status_code // 100 != 2:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        # An HTML page, the server does not know the endpoint
+        return None
+
+
+def _export(config, kind, output=None, export_format='jsonl', limit=100,
+            workers=4, incremental=False, mark_dir=None):
+    """Export the tasks, task runs or results of a project to a file.
+
+    The records are written as they arrive, one JSON object per line or one
+    CSV row each, so the memory used does not grow with the project. With
+    incremental, only the records created since the last export to the same
+    file are appended to it.
+    """
+    try:
+        project = _find_project(config)
+        if output is None:
+            output = '%s_%s.%s' % (project.short_name, kind, export_format)
+        write = _write_csv if export_format == 'csv' else _write_jsonl
+        if incremental:
+            mark = ExportMark(_export_mark_path(config, project.id, kind,
+                                                mark_dir),
+                              os.path.abspath(output))
+            count = _export_new_records(config, project, kind, output, write,
+                                        mark, limit)
+            return "%s new %s exported to %s" % (count, kind, output)
+        records = _iter_pages(config, 'find_' + kind, project.id, limit,
+                              workers)
+        if output == '-':
+            count = write((r.data for r in records),
+                          click.get_text_stream('stdout'))
+        else:
+            with _progressbar(records, "Exporting %s" % kind) as pgbar:
+                count = _write_file(output, write, (r.data for r in pgbar))
+        return "%s %s exported to %s" % (count, kind, output)
+    except exceptions.ConnectionError:
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
+    except (ProjectNotFound, TaskNotFound):
+        raise
+
+
+def _export_new_records(config, project, kind, output, write, mark, limit):
+    """Append the records after the one of mark to output.
+
+    Return how many records were appended. The mark only moves forward once
+    the records are in the file, and the file is cut back to the size of the
+    mark before appending, so an interrupted export neither loses nor
+    duplicates records.
+    """
+    try:
+        size = os.path.getsize(output)
+    except OSError:
+        size = None
+    if size is None or size < mark.size:
+        # It is not the file of the mark, export everything again
+        mark.reset()
+    with open(output, 'a+', newline='') as f:
+        f.seek(0)
+        # Keep the columns of the exported CSV rows
+        header = f.readline() if mark.size and write is _write_csv else ''
+        fieldnames = next(csv.reader([header])) if header else None
+        f.truncate(mark.size)
+        f.seek(0, os.SEEK_END)
+        records = _iter_records(config, 'get_' + kind, project.id, limit,
+                                mark.last_id)
+        records = _marked(records, mark, f)
+        with _progressbar(records, "Exporting %s" % kind) as pgbar:
+            rows = (r.data for r in pgbar)
+            if fieldnames:
+                return write(rows, f, fieldnames)
+            return write(rows, f)
+
+
+def _marked(records, mark, f):
+    """Yield records, committing to mark the ones already written to f."""
+    last_id = None
+    for record in records:
+        if last_id is not None and mark.due():
+            mark.commit(last_id, f)
+        yield record
+        last_id = record.id
+    # Asking for the next record means the last one was written
+    if last_id is not None:
+        mark.commit(last_id, f)
+
+
+def _export_mark_path(config, project_id, kind, mark_dir=None):
+    """Return the path of the ExportMark of the records of a project."""
+    mark_dir = mark_dir or os.path.join(CACHE_DIR, 'export')
+    return os.path.join(mark_dir, '%s-%s-%s.json' % (_server_key(config.server),
+                                                     project_id, kind))
+
+
+def _write_file(path, write, rows):
+    """Write rows to path with write and return how many were written.
+
+    The rows are written to a temporary file that replaces path at the end,
+    as a half written file would look complete.
+    """
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w', newline='') as f:
+            count = write(rows, f)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return count
+
+
+def _write_jsonl(rows, f):
+    """Write rows as JSON lines and return how many were written."""
+    count = 0
+    for row in rows:
+        f.write(json.dumps(row) + '\n')
+        count += 1
+    return count
+
+
+def _write_csv(rows, f, fieldnames=None):
+    """Write rows as CSV rows and return how many were written.
+
+    The columns are fieldnames, or the fields of the first row with a header
+    row. The JSON fields, like info, are written as JSON.
+    """
+    writer = None
+    if fieldnames:
+        writer = csv.DictWriter(f, fieldnames, extrasaction='ignore')
+    count = 0
+    for row in rows:
+        row = dict((k, json.dumps(v) if isinstance(v, (dict, list)) else v)
+                   for k, v in row.items())
+        if writer is None:
+            writer = csv.DictWriter(f, list(row), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _update_mirror(config, kinds=EXPORT_KINDS, full=False, limit=100):
+    """Add the records created since the last update to the mirror."""
+    try:
+        project = _find_project(config)
+        counts = _refresh_mirror(config, project, kinds, full, limit)
+        news = ', '.join('%s new %s' % (counts[kind], kind) for kind in kinds)
+        return "Mirror of %s updated in %s: %s" % (project.short_name,
+                                                   config.mirror.path, news)
     except exceptions.ConnectionError:
-        return ("Connection Error! The server %s is not responding" % config.server)
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
     except (ProjectNotFound, TaskNotFound):
         raise
 
 
+def _refresh_mirror(config, project, kinds, full=False, limit=100):
+    """Mirror the records of a project after the last mirrored ones.
+
+    With full, the records are mirrored again from the first one, e.g. to
+    see the records changed or deleted in the server. Return the number of
+    records mirrored of every kind.
+    """
+    mirror = config.mirror
+    counts = dict()
+    for kind in kinds:
+        if full:
+            mirror.clear(kind, project.id)
+        records = _iter_records(config, 'get_' + kind, project.id, limit,
+                                mirror.last_id(kind, project.id))
+        with _progressbar(records, "Mirroring %s" % kind) as pgbar:
+            counts[kind] = mirror.add(kind, pgbar)
+    mirror.complete_tasks(project.id)
+    return counts
+
+
+def _project_tasks(config, project, limit=100, last_id=None,
+                   from_mirror=False):
+    """Return the tasks of a project after last_id, sorted by id.
+
+    With from_mirror they are read from the mirror, after mirroring the
+    tasks and task runs created since its last update.
+    """
+    mirror = config.mirror
+    if not from_mirror or mirror is None:
+        return _iter_tasks(config, project.id, limit, last_id)
+    _refresh_mirror(config, project, ('tasks', 'taskruns'), limit=limit)
+    return mirror.tasks(project.id, last_id)
+
+
+def _aggregate(config, output=None, export_format='jsonl', field=None,
+               taskruns_file=None):
+    """Write the consensus of the task runs of every task of a project.
+
+    The task runs are read from taskruns_file (e.g. from pbs export) or from
+    the mirror, after mirroring the new ones. For every task it writes the
+    majority answer, its share of the task runs (agreement) and the entropy
+    of the answers in bits. The answer is the info of the task runs, or its
+    field.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise click.UsageError("aggregate needs the numpy package: "
+                               "pip install pybossa-pbs[aggregate]")
+    try:
+        if output is None:
+            output = '%s_aggregate.%s' % (config.project['short_name'],
+                                          export_format)
+        if taskruns_file is None:
+            project = _find_project(config)
+            _refresh_mirror(config, project, ('taskruns',))
+            runs = config.mirror.taskruns(project.id)
+        else:
+            runs = (json.loads(line) for line in taskruns_file
+                    if line.strip())
+        task_ids, codes, answers = _load_answers(runs, field)
+        stats = _consensus(np, task_ids, codes)
+        # n_answers would be taken for the redundancy of the task
+        rows = (dict(task_id=int(task_id), n_taskruns=int(n_taskruns),
+                     n_distinct_answers=int(n_distinct),
+                     answer=json.loads(answers[code]),
+                     agreement=float(agreement), entropy=float(entropy))
+                for task_id, n_taskruns, n_distinct, code, agreement, entropy
+                in zip(*stats))
+        write = _write_csv if export_format == 'csv' else _write_jsonl
+        if output == '-':
+            count = write(rows, click.get_text_stream('stdout'))
+        else:
+            count = _write_file(output, write, rows)
+        return "%s tasks aggregated to %s" % (count, output)
+    except exceptions.ConnectionError:
+        return Failure("Connection Error! The server %s is not responding" %
+                       config.server)
+    except (ProjectNotFound, TaskNotFound):
+        raise
+
+
+def _load_answers(runs, field=None):
+    """Return the task ids, answer codes and answers of task runs.
+
+    Every distinct answer, as sorted JSON, gets the code of its position in
+    answers.
+    """
+    task_ids = []
+    codes = []
+    answers = dict()
+    for run in runs:
+        answer = run.get('info')
+        if field is not None:
+            answer = answer.get(field) if isinstance(answer, dict) else None
+        key = json.dumps(answer, sort_keys=True)
+        task_ids.append(run['task_id'])
+        codes.append(answers.setdefault(key, len(answers)))
+    return task_ids, codes, list(answers)
+
+
+def _consensus(np, task_ids, codes):
+    """Return the consensus statistics of the answers of every task.
+
+    task_ids and codes have the task and the answer code of every task run.
+    Return the arrays of the task ids, their task runs, distinct answers,
+    majority answer code, agreement and entropy. Ties go to the answer with
+    the lowest code, the first one seen in all the task runs.
+    """
+    tasks, task_index = np.unique(np.asarray(task_ids, dtype=np.int64),
+                                  return_inverse=True)
+    if not len(tasks):
+        return tasks, tasks, tasks, tasks, tasks, tasks
+    n_codes = max(codes) + 1
+    # Count every (task, answer) pair at once
+    pairs, counts = np.unique(task_index * n_codes +
+                              np.asarray(codes, dtype=np.int64),
+                              return_counts=True)
+    pair_task = pairs // n_codes
+    pair_code = pairs % n_codes
+    n_taskruns = np.bincount(task_index, minlength=len(tasks))
+    n_distinct = np.bincount(pair_task, minlength=len(tasks))
+    share = counts / n_taskruns[pair_task]
+    entropy = np.bincount(pair_task, weights=-share * np.log2(share),
+                          minlength=len(tasks))
+    # The first pair of every task by descending count is the majority
+    order = np.lexsort((pair_code, -counts, pair_task))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pair_task[order][1:] != pair_task[order][:-1]
+    top = order[first]
+    agreement = counts[top] / n_taskruns
+    return tasks, n_taskruns, n_distinct, pair_code[top], agreement, entropy
+
+
+def _find_project(config):
+    """Return the project of project.json, from the project cache if valid."""
+    short_name = config.project['short_name']
+    cache = config.project_cache
+    data = cache.get(short_name) if cache is not None else None
+    if data is not None:
+        # Callers modify the project, keep the cached copy intact
+        return config.pbclient.Project(copy.deepcopy(data))
+    project = find_project_by_short_name(short_name, config.pbclient,
+                                         config.all)
+    _cache_project(config, project)
+    return project
+
+
+def _cache_project(config, project):
+    """Store a project returned by the server in the project cache."""
+    cache = config.project_cache
+    if cache is not None and hasattr(project, 'data'):
+        cache.put(project.short_name, project.data)
+
+
 def find_project_by_short_name(short_name, pbclient, all=None):
     """Return project by short_name."""
     try:
@@ -365,11 +1511,16 @@ def find_project_by_short_name(short_name, pbclient, all=None):
 
 
 def check_api_error(api_response):
-    print(api_response)
-    """Check if returned API response contains an error."""
+    """Check if returned API response contains an error.
+
+    The responses are printed to stderr, as export and aggregate can write
+    their records to stdout.
+    """
+    print(api_response, file=sys.stderr)
     if type(api_response) == dict and 'code' in api_response and api_response['code'] != 200:
-            print(("Server response code: %s" % api_response['code']))
-            print(("Server response: %s" % api_response))
+            print(("Server response code: %s" % api_response['code']),
+                  file=sys.stderr)
+            print(("Server response: %s" % api_response), file=sys.stderr)
             raise exceptions.HTTPError('Unexpected response', response=api_response)
     if type(api_response) == dict and (api_response.get('status') == 'failed'):
         if 'ProgrammingError' in api_response.get('exception_cls'):
@@ -386,10 +1537,18 @@ def check_api_error(api_response):
             raise TaskNotFound(message='PyBossa Task not found',
                                error=api_response)
         else:
-            print(("Server response: %s" % api_response))
+            print(("Server response: %s" % api_response), file=sys.stderr)
             raise exceptions.HTTPError('Unexpected response', response=api_response)
 
 
+def _api_error(api_response):
+    """Return True if api_response is an error for check_api_error."""
+    if type(api_response) != dict:
+        return False
+    return (('code' in api_response and api_response['code'] != 200) or
+            api_response.get('status') == 'failed')
+
+
 def format_error(module, error):
     """Format the error for the given module."""
     logging.error(module)
@@ -428,7 +1587,8 @@ def enable_auto_throttling(config, data, limit=299, endpoint='/api/task'):
     "allowed by the server are requested."
     # Get header from server
     endpoint = config.server + endpoint
-    headers = requests.head(endpoint).headers
+    session = getattr(config, 'session', None) or requests
+    headers = session.head(endpoint).headers
     # Get limit
     server_limit = int(headers.get('X-RateLimit-Remaining', 0))
     limit = server_limit or limit
@@ -446,6 +1606,524 @@ def enable_auto_throttling(config, data, limit=299, endpoint='/api/task'):
         return 0, None
 
 
+class RateLimitGovernor(object):
+
+    """Pace API requests using the rate-limit headers sent by the server.
+
+    The governor is a token bucket shared by every writer. It is refilled
+    from the X-RateLimit-Remaining and X-RateLimit-Reset headers of the
+    responses the server already sends, so no extra requests are needed.
+    A Retry-After header empties the bucket until the server asks for.
+    """
+
+    def __init__(self, threshold=10, clock=time.time, sleep=time.sleep):
+        """Init method."""
+        self.threshold = threshold
+        self.remaining = None
+        self.reset = None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._last = threading.local()
+
+    def observe(self, response, *args, **kwargs):
+        """Update the bucket from a response (a requests response hook)."""
+        headers = response.headers
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        retry_after = _retry_after(headers.get('Retry-After'), self._clock())
+        # The answer of the request of this thread, see retry_later
+        self._last.retry_later = None
+        if retry_after is not None:
+            self._last.retry_later = getattr(response, 'status_code',
+                                             getattr(response, 'status', None))
+        with self._lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset = int(reset)
+            if retry_after is not None:
+                self.remaining = 0
+                self.reset = max(self.reset or 0, retry_after)
+        return response
+
+    def retry_later(self):
+        """Return the status of the last answer of this thread if it had a
+        Retry-After header, or None."""
+        return getattr(self._last, 'retry_later', None)
+
+    def acquire(self):
+        """Take a token, or return the seconds to wait for the next one."""
+        with self._lock:
+            now = self._clock()
+            if self.reset is not None and now >= self.reset:
+                # The window is over, the server has refilled the bucket
+                self.remaining = None
+                self.reset = None
+            if (self.remaining is None or self.remaining > self.threshold or
+                    self.reset is None):
+                if self.remaining is not None:
+                    self.remaining -= 1
+                return 0
+            return self.reset - now
+
+    def wait(self, verbose=False):
+        """Block until a request can be sent. Return the seconds slept."""
+        # A new request of this thread
+        self._last.retry_later = None
+        slept = 0
+        sleep = self.acquire()
+        while sleep > 0:
+            if verbose:  # pragma: no cover
+                msg = 'Warning: %s remaining hits to the endpoint.' \
+                      ' Auto-throttling enabled!' % self.remaining
+                click.secho(msg, fg='yellow')
+            self._sleep(sleep)
+            slept += sleep
+            sleep = self.acquire()
+        return slept
+
+
+def _retry_after(value, now):
+    """Return the time given by a Retry-After header, or None."""
+    if value is None:
+        return None
+    try:
+        return now + int(value)
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        return email.utils.mktime_tz(date) if date else None
+
+
+def create_session(governor, pool_size=16, keep_alive=True):
+    """Return a requests session that feeds its responses to governor.
+
+    The session keeps up to pool_size connections per host open, so the
+    requests reuse them instead of paying a new TCP and TLS handshake.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    session.hooks['response'].append(governor.observe)
+    return session
+
+
+def _call_api(config, method, *args, dead_letter=None, verbose=False,
+              **kwargs):
+    """Return config.pbclient.<method>(*args, **kwargs) retrying its errors.
+
+    Only the transient errors are retried, see RetryPolicy. The response is
+    None if the call was written to dead_letter.
+    """
+    func = getattr(config.pbclient, method)
+
+    def send(**kwargs):
+        # Wait if the server rate limit is about to be exhausted
+        config.governor.wait(verbose=verbose)
+        try:
+            response = func(*args, **kwargs)
+        except ValueError:
+            # A non JSON page, unless the server asked to retry later
+            if config.governor.retry_later() not in RETRY_LATER_CODES:
+                raise
+            response = None
+        code = config.governor.retry_later()
+        if code in RETRY_LATER_CODES:
+            return retry_later(code)
+        return response
+    retry = config.retry
+    if retry is None:
+        return send(**kwargs)
+    return retry.call(method, send, kwargs, dead_letter)
+
+
+def _send_requests(config, method, calls, workers=1, dead_letter=None,
+                   missing_ok=False, on_response=None):
+    """Send config.pbclient.<method>(**kwargs) for every (tag, kwargs) in calls.
+
+    The requests go through the asyncio client when pbs runs with --async,
+    otherwise through up to workers threads. The responses are checked with
+    check_api_error and yielded as (tag, response) in completion order. The
+    calls that keep failing after the retries are written to dead_letter,
+    if given, and yielded with a None response. With missing_ok, the not
+    found answers are yielded instead of raising TaskNotFound.
+
+    on_response(tag, response), if given, is called as soon as each response
+    arrives, from the thread that sent it. Closing the generator waits for
+    the requests in flight, so on_response sees every request that reached
+    the server.
+    """
+    if config.async_client is not None:
+        responses = config.async_client.map(method, calls, config.retry,
+                                            dead_letter, on_response)
+    else:
+        def send(call):
+            tag, kwargs = call
+            response = _call_api(config, method, dead_letter=dead_letter,
+                                 **kwargs)
+            if on_response is not None:
+                on_response(tag, response)
+            return tag, response
+        responses = _bounded_map(send, calls, workers)
+    try:
+        for tag, response in responses:
+            if response is not None and not (missing_ok and
+                                             status_code(response) == 404):
+                check_api_error(response)
+            yield tag, response
+    finally:
+        close = getattr(responses, 'close', None)
+        if close is not None:
+            close()
+
+
+class TaskJournal(object):
+
+    """On-disk record of the rows of a tasks file already created.
+
+    Rows can finish out of order when they are sent concurrently, so the
+    journal commits the longest run of finished rows from the start of the
+    file: rows is the number of committed rows and offset the byte offset of
+    the next row (None if the file cannot be sought). The rows finished after
+    it are kept as ranges of row numbers, and created has the ones of the
+    previous run, to skip them when resuming.
+    """
+
+    def __init__(self, path, fingerprint, interval=1.0, clock=time.time):
+        """Init method."""
+        self.path = path
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self._clock = clock
+        self.rows = 0
+        self.offset = 0
+        self.created = set()
+        self._finished = dict()
+        self._saved = clock()
+        # Rows are recorded from the threads that send them
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        """Read the committed rows if the journal is for the same file."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+        if state.get('fingerprint') == self.fingerprint:
+            self.rows = state['rows']
+            self.offset = state['offset']
+            self.created = set(itertools.chain.from_iterable(
+                range(first, last + 1)
+                for first, last in state.get('finished', [])))
+
+    def reset(self):
+        """Forget the committed rows."""
+        self.rows = 0
+        self.offset = 0
+        self.created = set()
+        self._finished = dict()
+
+    def done(self, index, offset):
+        """Record that row index, followed by offset, has been created."""
+        with self._lock:
+            self._finished[index] = offset
+            while self.rows in self._finished:
+                self.offset = self._finished.pop(self.rows)
+                self.rows += 1
+            if self._clock() - self._saved >= self.interval:
+                self.save()
+
+    def save(self):
+        """Write the committed rows atomically."""
+        with self._lock:
+            finished = sorted(index for index
+                              in self.created.union(self._finished)
+                              if index >= self.rows)
+            ranges = []
+            for index in finished:
+                if ranges and ranges[-1][1] == index - 1:
+                    ranges[-1][1] = index
+                else:
+                    ranges.append([index, index])
+            _write_json(self.path, dict(fingerprint=self.fingerprint,
+                                        rows=self.rows, offset=self.offset,
+                                        finished=ranges))
+            self._saved = self._clock()
+
+    def remove(self):
+        """Delete the journal once every row has been created."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class TaskIndex(object):
+
+    """On-disk set of the hashes of the tasks of a project.
+
+    last_id is the id of the last server task added to the index, so the
+    next runs only page through the tasks created since then.
+    """
+
+    def __init__(self, path, load=True):
+        """Init method."""
+        self.path = path
+        self.last_id = None
+        self.hashes = set()
+        if not load:
+            return
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            self.last_id = state['last_id']
+            self.hashes = set(state['hashes'])
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def __contains__(self, digest):
+        return digest in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, digest):
+        """Add the hash of a task."""
+        self.hashes.add(digest)
+
+    def save(self):
+        """Write the index atomically."""
+        _write_json(self.path, dict(last_id=self.last_id,
+                                    hashes=list(self.hashes)))
+
+    def remove(self):
+        """Delete the index (e.g. when the project tasks are deleted)."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ExportMark(object):
+
+    """On-disk high-water mark of the incremental export to a file.
+
+    last_id is the id of the last record exported to output, and size the
+    size of output after writing it. Records are only created with growing
+    ids, so the next export starts after last_id.
+    """
+
+    def __init__(self, path, output, interval=1.0, clock=time.time):
+        """Init method."""
+        self.path = path
+        self.output = output
+        self.interval = interval
+        self._clock = clock
+        self.last_id = None
+        self.size = 0
+        self._saved = clock()
+        self._load()
+
+    def _load(self):
+        """Read the mark if it is for the same output file."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+        if state.get('output') == self.output:
+            self.last_id = state['last_id']
+            self.size = state['size']
+
+    def reset(self):
+        """Forget the exported records."""
+        self.last_id = None
+        self.size = 0
+
+    def due(self):
+        """Return True if the mark has not been saved for interval seconds."""
+        return self._clock() - self._saved >= self.interval
+
+    def commit(self, last_id, f):
+        """Record that f has every record up to last_id, and save it."""
+        f.flush()
+        self.last_id = last_id
+        self.size = f.tell()
+        self.save()
+
+    def save(self):
+        """Write the mark atomically."""
+        _write_json(self.path, dict(output=self.output, last_id=self.last_id,
+                                    size=self.size))
+        self._saved = self._clock()
+
+
+class ProjectCache(object):
+
+    """On-disk cache of the projects of a server found by short_name.
+
+    Finding a project is a search in the server, so the projects are kept
+    for ttl seconds. With refresh the cached projects are ignored, and
+    replaced by the ones found in the server.
+    """
+
+    def __init__(self, path, ttl=3600, refresh=False, clock=time.time):
+        """Init method."""
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.projects = dict()
+        try:
+            with open(path) as f:
+                self.projects = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, short_name):
+        """Return the data of a cached project, or None."""
+        entry = self.projects.get(short_name)
+        if (self.refresh or entry is None or
+                self._clock() - entry['time'] > self.ttl):
+            return None
+        return entry['project']
+
+    def put(self, short_name, data):
+        """Store the data of a project."""
+        with self._lock:
+            self.projects[short_name] = dict(time=self._clock(),
+                                             project=data)
+            self._save()
+
+    def remove(self, short_name):
+        """Forget a project."""
+        with self._lock:
+            if self.projects.pop(short_name, None) is not None:
+                self._save()
+
+    def _save(self):
+        """Write the cache atomically."""
+        _write_json(self.path, self.projects)
+
+
+class ProjectManifest(object):
+
+    """On-disk hashes of the project fields last uploaded to a server."""
+
+    def __init__(self, path):
+        """Init method."""
+        self.path = path
+        self._lock = threading.Lock()
+        self.projects = dict()
+        try:
+            with open(path) as f:
+                self.projects = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    @staticmethod
+    def digest(value):
+        """Return the hash of a field."""
+        return hashlib.sha1(str(value).encode('utf-8')).hexdigest()
+
+    def changed(self, project_id, fields):
+        """Return the sorted keys of fields changed since the last upload."""
+        hashes = self.projects.get(str(project_id), dict())
+        return sorted(key for key, value in fields.items()
+                      if hashes.get(key) != self.digest(value))
+
+    def update(self, project_id, fields):
+        """Record the uploaded fields and write the manifest atomically."""
+        hashes = dict((key, self.digest(value))
+                      for key, value in fields.items())
+        # Projects are updated concurrently by watch_projects
+        with self._lock:
+            self.projects[str(project_id)] = hashes
+            _write_json(self.path, self.projects)
+
+
+def _server_key(server):
+    """Return a short stable name for the files of a server."""
+    return hashlib.sha1(str(server).encode('utf-8')).hexdigest()[:12]
+
+
+def _write_json(path, data):
+    """Write data as JSON to path atomically, only readable by the user.
+
+    The cache files have API responses, like the owner fields of projects.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # An old temporary file keeps its mode
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def create_project_manifest(server, cache_dir=None):
+    """Return the ProjectManifest of a server."""
+    cache_dir = cache_dir or os.path.join(CACHE_DIR, 'manifest')
+    return ProjectManifest(os.path.join(cache_dir,
+                                        _server_key(server) + '.json'))
+
+
+def create_project_cache(server, credentials, refresh=False, cache_dir=None):
+    """Return the ProjectCache of a server and .pybossa.cfg section."""
+    cache_dir = cache_dir or os.path.join(CACHE_DIR, 'projects')
+    name = _server_key('%s|%s' % (server, credentials))
+    return ProjectCache(os.path.join(cache_dir, name + '.json'),
+                        refresh=refresh)
+
+
+def create_mirror(server, cache_dir=None, create=True):
+    """Return the Mirror of a server, or None if it has none and not create."""
+    cache_dir = cache_dir or os.path.join(CACHE_DIR, 'mirror')
+    path = os.path.join(cache_dir, _server_key(server) + '.sqlite')
+    if not create and not os.path.exists(path):
+        return None
+    return Mirror(path)
+
+
+def _bounded_map(func, iterable, workers=1):
+    """Apply func to every item keeping up to workers calls in flight.
+
+    With one worker the items are processed in order in the calling thread.
+    Otherwise the results are returned in completion order.
+    """
+    if workers is None or workers <= 1:
+        return map(func, iterable)
+    return _threaded_map(func, iterable, workers)
+
+
+def _threaded_map(func, iterable, workers):
+    """Yield func(item) from a thread pool with a bounded queue."""
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        try:
+            for item in iterable:
+                # Do not read further input while the queue is full
+                while len(pending) >= workers * 2:
+                    done, pending = futures.wait(
+                        pending, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(func, item))
+            for future in futures.as_completed(pending):
+                yield future.result()
+        except BaseException:
+            # Do not start queued calls if something went wrong
+            for future in pending:
+                future.cancel()
+            raise
+
+
 def format_json_task(task_info):
     """Format task_info into JSON if applicable."""
     try:
@@ -462,24 +2140,109 @@ def row_empty(row):
     return True
 
 
-class PbsHandler(PatternMatchingEventHandler):
+class DebouncedUploader(object):
+
+    """Run upload on a background thread once the events stop.
+
+    A burst of events is coalesced into one upload, run delay seconds after
+    the last event. Events that arrive during an upload schedule a single
+    new one, so the stale uploads are dropped and the latest files win.
+    """
+
+    def __init__(self, upload, delay=0.5, clock=time.monotonic):
+        """Init method."""
+        self.upload = upload
+        self.delay = delay
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._due = None
+        self._closed = False
+        self._thread = None
+
+    def trigger(self):
+        """Schedule an upload, postponing the pending one."""
+        with self._cond:
+            self._due = self._clock() + self.delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def close(self):
+        """Run the pending upload now and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._due is None or not self._closed:
+                    if self._due is None:
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                        continue
+                    wait = self._due - self._clock()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                self._due = None
+            try:
+                self.upload()
+            except Exception:
+                logging.exception("Upload failed")
+
+
+class PbsHandler(object):
+
+    """Update a project when its files change (a watchdog event handler).
+
+    It does not subclass watchdog's PatternMatchingEventHandler so watchdog
+    is only imported by the watch commands.
+    """
 
     patterns = ['*/template.html', '*/tutorial.html',
                 '*/long_description.md', '*/results.html',
                 '*/bundle.js', '*/bundle.min.js']
 
     def __init__(self, config, task_presenter, results,
-                 long_description, tutorial):
-        super(PbsHandler, self).__init__()
+                 long_description, tutorial, delay=0.5, bundle_dir=''):
         self.config = config
         self.task_presenter = task_presenter
         self.results = results
         self.long_description = long_description
         self.tutorial = tutorial
+        self.bundle_dir = bundle_dir
+        self.uploader = DebouncedUploader(self.upload, delay)
+
+    def dispatch(self, event):
+        """Call the on_<event type> method for the files in patterns."""
+        if event.is_directory:
+            return
+        paths = [event.src_path, getattr(event, 'dest_path', None)]
+        if not any(path and fnmatch.fnmatch(os.fsdecode(path), pattern)
+                   for path in paths for pattern in self.patterns):
+            return
+        method = getattr(self, 'on_' + event.event_type, None)
+        if method is not None:
+            method(event)
+
+    def upload(self):
+        res = _update_project(self.config, self.task_presenter, self.results,
+                              self.long_description, self.tutorial,
+                              self.bundle_dir)
+        logging.info(res)
 
     def on_modified(self, event):
         what = 'directory' if event.is_directory else 'file'
         logging.info("Modified %s: %s", what, event.src_path)
-        res = _update_project(self.config, self.task_presenter, self.results,
-                              self.long_description, self.tutorial)
-        logging.info(res)
+        self.uploader.trigger()
+
+    # Editors often save to a new file and rename it
+    on_created = on_modified
+    on_moved = on_modified
@@ -28,13 +28,13 @@ This module is a pybossa-client that runs the following commands:
 
 import click
 import pbclient
-import simplejson as json
-from simplejson import JSONDecodeError
-import jsonschema
 import configparser
 import os.path
 from os.path import expanduser
 from helpers import *
+from asyncclient import AsyncClient
+from pbsretry import RetryPolicy
+import pbsd
 
 
 class Config(object):
@@ -48,7 +48,15 @@ class Config(object):
         self.api_key = None
         self.project = None
         self.all = None
+        self.refresh = False
         self.pbclient = pbclient
+        self.governor = RateLimitGovernor()
+        self.retry = RetryPolicy()
+        self.project_cache = None
+        self.manifest = None
+        self.mirror = None
+        self.session = None
+        self.async_client = None
         self.parser = configparser.ConfigParser()
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
@@ -60,9 +68,24 @@ pass_config = click.make_pass_decorator(Config, ensure=True)
 @click.option('--all', help='Search across all projects')
 @click.option('--credentials', help='Use your PYBOSSA credentials in .pybossa.cfg file',
               default="default")
-@click.option('--project', type=click.File('r'), default='project.json')
+@click.option('--project', type=click.Path(dir_okay=False),
+              default='project.json')
+@click.option('--async', 'use_async', is_flag=True,
+              help='Send write requests concurrently with asyncio (needs aiohttp)')
+@click.option('--async-limit', help='Maximum concurrent requests with --async',
+              default=100, type=click.IntRange(1, None))
+@click.option('--pool-size', help='Connections kept open to the server',
+              default=16, type=click.IntRange(1, None))
+@click.option('--keep-alive/--no-keep-alive', default=True,
+              help='Reuse the connections to the server')
+@click.option('--retries', help='Retries of a request after a transient error',
+              default=5, type=click.IntRange(0, None))
+@click.option('--refresh', is_flag=True,
+              help='Find the project in the server, not in the local cache, '
+              'and rebuild the task index of --dedup')
 @pass_config
-def cli(config, server, api_key, all, credentials, project):
+def cli(config, server, api_key, all, credentials, project, use_async,
+        async_limit, pool_size, keep_alive, retries, refresh):
     """Create the cli command line."""
     # Check first for the pybossa.rc file to configure server and api-key
     home = expanduser("~")
@@ -80,33 +103,38 @@ def cli(config, server, api_key, all, credentials, project):
         config.api_key = api_key
     if all:
         config.all = all
-    try:
-        config.project = json.loads(project.read())
-    except JSONDecodeError as e:
-        click.secho("Error: invalid JSON format in project.json:", fg='red')
-        if e.msg == 'Expecting value':
-            e.msg += " (if string enclose it with double quotes)"
-        click.echo("%s\n%s: line %s column %s" % (e.doc, e.msg, e.lineno, e.colno))
-        raise click.Abort()
-    try:
-        project_schema = {
-            "type": "object",
-            "properties": {
-                "name": {"type": "string"},
-                "short_name": {"type": "string"},
-                "description": {"type": "string"}
-            }
-        }
-        jsonschema.validate(config.project, project_schema)
-    except jsonschema.exceptions.ValidationError as e:
-        click.secho("Error: invalid type in project.json", fg='red')
-        click.secho("'%s': %s" % (e.path[0], e.message), fg='yellow')
-        click.echo("'%s' must be a %s" % (e.path[0], e.validator_value))
-        raise click.Abort()
+    # These commands find the project.json files themselves
+    command = click.get_current_context().invoked_subcommand
+    if command not in ('watch-projects', 'batch', 'daemon'):
+        try:
+            with click.open_file(project) as f:
+                config.project = _load_project(f)
+        except IOError as e:
+            raise click.BadParameter("Could not open file: %s: %s" %
+                                     (project, e.strerror),
+                                     param_hint='"--project"')
 
     config.pbclient = pbclient
     config.pbclient.set('endpoint', config.server)
     config.pbclient.set('api_key', config.api_key)
+    # Route pbclient requests through a session that feeds the governor
+    # (the daemon passes the session it keeps open)
+    if config.session is None:
+        config.session = create_session(config.governor, pool_size,
+                                        keep_alive)
+    config.pbclient.requests = config.session
+    config.retry = RetryPolicy(retries)
+    config.refresh = refresh
+    config.project_cache = create_project_cache(config.server, credentials,
+                                                refresh)
+    if use_async:
+        try:
+            config.async_client = AsyncClient(config.server, config.api_key,
+                                              config.governor, async_limit)
+        except ImportError as e:
+            click.secho("Error: %s" % e, fg='red')
+            raise click.Abort()
+        click.get_current_context().call_on_close(config.async_client.close)
 
 
 @cli.command()
@@ -137,56 +165,157 @@ def create_project(config): # pragma: no cover
               default='tutorial.html')
 @click.option('--watch/--no-watch', help='Watch for changes in the current folder and update the project',
               default=False)
+@click.option('--force', is_flag=True,
+              help='Send all the fields, even if they did not change')
+@click.option('--debounce', help='Seconds to wait for more changes before '
+              'updating the project with --watch', default=0.5,
+              type=click.FloatRange(0, None))
 @pass_config
 def update_project(config, task_presenter, results,
-                   long_description, tutorial, watch): # pragma: no cover
+                   long_description, tutorial, watch, force,
+                   debounce): # pragma: no cover
     """Update project templates and information."""
+    # Only send the fields changed since the last update
+    if not force:
+        config.manifest = create_project_manifest(config.server)
     if watch:
         res = _update_project_watch(config, task_presenter, results,
-                                    long_description, tutorial)
+                                    long_description, tutorial, debounce)
     else:
         res = _update_project(config, task_presenter, results,
                               long_description, tutorial)
         click.echo(res)
 
 
+@cli.command()
+@click.argument('root', default='.',
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--debounce', help='Seconds to wait for more changes before '
+              'updating a project', default=0.5,
+              type=click.FloatRange(0, None))
+@click.option('--force', is_flag=True,
+              help='Send all the fields, even if they did not change')
+@pass_config
+def watch_projects(config, root, debounce, force): # pragma: no cover
+    """Watch every project.json folder under ROOT and update the projects."""
+    if not force:
+        config.manifest = create_project_manifest(config.server)
+    res = _watch_projects(config, root, debounce)
+    if res:
+        click.echo(res)
+
+
+@cli.command()
+@click.option('--socket', 'path', help='Unix socket of the daemon',
+              default=pbsd.DEFAULT_SOCKET, envvar='PBS_DAEMON_SOCKET')
+@pass_config
+def daemon(config, path): # pragma: no cover
+    """Run the pbs commands sent by pbs clients (see PBS_DAEMON_SOCKET)."""
+    def run(args):
+        # Every command gets a new config with the open connections
+        request_config = Config()
+        request_config.governor = config.governor
+        request_config.session = config.session
+        return cli.main(args, prog_name='pbs', obj=request_config,
+                        standalone_mode=False)
+
+    server = pbsd.create_server(path, run)
+    click.echo("pbs daemon listening on %s" % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+@cli.command()
+@click.argument('manifest', type=click.File('r'))
+@click.option('--workers', help="Number of projects run concurrently.",
+              default=4, type=click.IntRange(1, None))
+@click.option('--yes', is_flag=True,
+              help="Do not ask before deleting or updating all the tasks")
+@pass_config
+def batch(config, manifest, workers, yes):
+    """Run the operations of a MANIFEST file (YAML or JSON)."""
+    operations = _load_batch(manifest)
+    bulk = [op for op in operations
+            if op['command'] in ('delete_tasks', 'update_task_redundancy') and
+            op.get('task_id') is None]
+    msg = ("%s operations delete or update all the tasks of a project. "
+           "Are you sure?" % len(bulk))
+    if bulk and not yes and not click.confirm(msg):
+        raise click.Abort()
+    config.manifest = create_project_manifest(config.server)
+    failed = _run_batch(config, operations, os.path.dirname(manifest.name),
+                        workers)
+    if failed:
+        click.secho("%s operations were not done" % failed, fg='red')
+        click.get_current_context().exit(1)
+
+
 @cli.command()
 @click.option('--tasks-file', help='File with tasks',
               default='project.tasks', type=click.File('r'))
-@click.option('--tasks-type', help='Tasks type: JSON|CSV|XLSX|XLSM|XLTX|XLTM|PO|PROPERTIES',
-              default=None, type=click.Choice(['json', 'csv', 'xlsx', 'xlsm',
-                                               'xltx', 'xltm', 'po', 'properties']))
+@click.option('--tasks-type', help='Tasks type: JSON|JSONL|NDJSON|CSV|XLSX|XLSM|XLTX|XLTM|PO|PROPERTIES',
+              default=None, type=click.Choice(['json', 'jsonl', 'ndjson', 'csv',
+                                               'xlsx', 'xlsm', 'xltx', 'xltm',
+                                               'po', 'properties']))
 @click.option('--priority', help="Priority for the tasks.", default=0)
 @click.option('--redundancy', help="Redundancy for tasks.", default=30)
+@click.option('--workers', help="Number of tasks created concurrently.",
+              default=1, type=click.IntRange(1, None))
+@click.option('--sheet', help="Excel sheet to load (default: the active one, "
+              "'*' for all the sheets)", default=None)
+@click.option('--resume', is_flag=True,
+              help="Continue an interrupted import of the same tasks file")
+@click.option('--dedup', is_flag=True,
+              help="Skip the tasks that already exist in the project")
+@click.option('--dead-letter', help="JSONL file for the tasks that fail "
+              "after all the retries", default='failed_tasks.jsonl')
 @pass_config
-def add_tasks(config, tasks_file, tasks_type, priority, redundancy):
+def add_tasks(config, tasks_file, tasks_type, priority, redundancy, workers,
+              sheet, resume, dedup, dead_letter):
     """Add tasks to a project."""
-    res = _add_tasks(config, tasks_file, tasks_type, priority, redundancy)
+    res = _add_tasks(config, tasks_file, tasks_type, priority, redundancy,
+                     workers, sheet, resume, dedup=dedup,
+                     dead_letter=dead_letter)
     click.echo(res)
 
 
 @cli.command()
 @click.option('--helping-materials-file', help='File with helping materials',
               default='helping.materials', type=click.File('r'))
-@click.option('--helping-type', help='Tasks type: JSON|CSV|XLSX|XLSM|XLTX|XLTM',
-              default=None, type=click.Choice(['json', 'csv', 'xlsx', 'xlsm',
-                                               'xltx', 'xltm']))
+@click.option('--helping-type', help='Tasks type: JSON|JSONL|NDJSON|CSV|XLSX|XLSM|XLTX|XLTM',
+              default=None, type=click.Choice(['json', 'jsonl', 'ndjson', 'csv',
+                                               'xlsx', 'xlsm', 'xltx', 'xltm']))
+@click.option('--sheet', help="Excel sheet to load (default: the active one, "
+              "'*' for all the sheets)", default=None)
 @pass_config
-def add_helpingmaterials(config, helping_materials_file, helping_type):
+def add_helpingmaterials(config, helping_materials_file, helping_type, sheet):
     """Add helping materials to a project."""
-    res = _add_helpingmaterials(config, helping_materials_file, helping_type)
+    res = _add_helpingmaterials(config, helping_materials_file, helping_type,
+                                sheet)
     click.echo(res)
 
 
 @cli.command()
 @click.option('--task-id', help='Task ID to delete from project', default=None)
+@click.option('--workers', help="Number of tasks deleted concurrently.",
+              default=1, type=click.IntRange(1, None))
+@click.option('--from-mirror', is_flag=True,
+              help="Read the tasks from the local mirror (see pbs mirror)")
 @pass_config
-def delete_tasks(config, task_id):
+def delete_tasks(config, task_id, workers, from_mirror):
     """Delete tasks from a project."""
+    # Keep the mirror, if any, up to date
+    config.mirror = create_mirror(config.server, create=from_mirror)
     if task_id is None:
         msg = ("Are you sure you want to delete all the tasks and associated task runs?")
         if click.confirm(msg):
-            res = _delete_tasks(config, task_id)
+            res = _delete_tasks(config, task_id, workers=workers,
+                                from_mirror=from_mirror)
             click.echo(res)
 
         else:
@@ -198,13 +327,34 @@ def delete_tasks(config, task_id):
 @cli.command(name='update-task-redundancy')
 @click.option('--task-id', help='Task ID to update from project', default=None)
 @click.option('--redundancy', help='New redundancy for task', default=None)
+@click.option('--workers', help="Number of tasks updated concurrently.",
+              default=1, type=click.IntRange(1, None))
+@click.option('--bulk/--no-bulk', help="Update all the tasks with one request "
+              "if the server supports it", default=False)
+@click.option('--only-incomplete', is_flag=True,
+              help="Only update the tasks that are not completed")
+@click.option('--min-id', help="Only update the tasks from this ID",
+              default=None, type=int)
+@click.option('--max-id', help="Only update the tasks up to this ID",
+              default=None, type=int)
+@click.option('--from-mirror', is_flag=True,
+              help="Read the tasks from the local mirror (see pbs mirror). "
+              "Run pbs mirror --full first if the tasks were changed outside "
+              "pbs")
 @pass_config
-def update_task_redundancy(config, task_id, redundancy):
+def update_task_redundancy(config, task_id, redundancy, workers, bulk,
+                           only_incomplete, min_id, max_id, from_mirror):
     """Update task redudancy for a project."""
+    # Keep the mirror, if any, up to date
+    config.mirror = create_mirror(config.server, create=from_mirror)
     if task_id is None:
         msg = ("Are you sure you want to update all the tasks redundancy?")
         if click.confirm(msg):
-            res = _update_tasks_redundancy(config, task_id, redundancy)
+            res = _update_tasks_redundancy(config, task_id, redundancy,
+                                           workers=workers, bulk=bulk,
+                                           only_incomplete=only_incomplete,
+                                           min_id=min_id, max_id=max_id,
+                                           from_mirror=from_mirror)
             click.echo(res)
 
         else:
@@ -212,3 +362,62 @@ def update_task_redundancy(config, task_id, redundancy):
     else:
         res = _update_tasks_redundancy(config, task_id, redundancy)
         click.echo(res)
+
+
+@cli.command()
+@click.argument('kind', type=click.Choice(EXPORT_KINDS))
+@click.option('--format', 'export_format', help='Output format',
+              default='jsonl', type=click.Choice(['jsonl', 'csv']))
+@click.option('--output', help='Output file, - for the standard output '
+              '(default: SHORT_NAME_KIND.FORMAT)', default=None)
+@click.option('--workers', help="Number of pages fetched concurrently.",
+              default=4, type=click.IntRange(1, None))
+@click.option('--limit', help="Number of records per page (at most 100).",
+              default=100, type=click.IntRange(1, 100))
+@click.option('--incremental', is_flag=True,
+              help="Only append the records created since the last export "
+              "to the same file")
+@pass_config
+def export(config, kind, export_format, output, workers, limit, incremental):
+    """Export the tasks, taskruns or results of a project."""
+    if incremental and output == '-':
+        raise click.BadParameter("an incremental export needs a file",
+                                 param_hint='--output')
+    res = _export(config, kind, output, export_format, limit, workers,
+                  incremental)
+    # Keep the standard output for the records
+    click.echo(res, err=output == '-')
+
+
+@cli.command()
+@click.option('--kind', 'kinds', help='Records to mirror (default: all)',
+              multiple=True, type=click.Choice(EXPORT_KINDS))
+@click.option('--full', is_flag=True,
+              help="Mirror every record again, to see the changed and "
+              "deleted ones")
+@pass_config
+def mirror(config, kinds, full):
+    """Keep a local SQLite copy of the tasks, taskruns and results."""
+    config.mirror = create_mirror(config.server)
+    res = _update_mirror(config, kinds or EXPORT_KINDS, full)
+    click.echo(res)
+
+
+@cli.command()
+@click.option('--taskruns-file', help='JSONL file with the task runs (e.g. '
+              'from pbs export taskruns) instead of the mirror',
+              default=None, type=click.File('r'))
+@click.option('--field', help='Field of the task run info with the answer '
+              '(default: the whole info)', default=None)
+@click.option('--format', 'export_format', help='Output format',
+              default='jsonl', type=click.Choice(['jsonl', 'csv']))
+@click.option('--output', help='Output file, - for the standard output '
+              '(default: SHORT_NAME_aggregate.FORMAT)', default=None)
+@pass_config
+def aggregate(config, taskruns_file, field, export_format, output):
+    """Write the majority answer, agreement and entropy of every task."""
+    if taskruns_file is None:
+        config.mirror = create_mirror(config.server)
+    res = _aggregate(config, output, export_format, field, taskruns_file)
+    # Keep the standard output for the results
+    click.echo(res, err=output == '-')
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+pbs daemon and its thin client.
+
+The daemon keeps pbs loaded and its connections to the server open, and runs
+the commands that pbs clients send to it over a Unix socket. With the
+PBS_DAEMON_SOCKET environment variable, the pbs command is a thin client that
+only imports this module and forwards its arguments to the daemon.
+
+This module exports the following methods:
+    * main: the pbs entry point.
+    * create_server: return the daemon server of a socket.
+    * forward: run a pbs command in the daemon.
+
+The client sends one JSON line with the arguments and working directory of
+the command. The daemon answers with JSON lines with the output (out), errors
+(err) and finally the exit code (exit) of the command. When the command reads
+a line (e.g. a confirmation prompt) the daemon sends a read message, and the
+client answers with the next line of its standard input. A read message with
+a size asks for up to size characters of the input instead, or bytes encoded
+in base64 if it is binary, and an empty answer is the end of the input.
+"""
+import io
+import base64
+import os
+import sys
+import json
+import socket
+import threading
+import contextlib
+import socketserver
+
+
+__all__ = ['main', 'create_server', 'forward', 'DEFAULT_SOCKET']
+
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'pbs',
+                              'daemon.sock')
+
+
+def main():
+    """Run pbs, in the daemon if PBS_DAEMON_SOCKET is set."""
+    path = os.environ.get('PBS_DAEMON_SOCKET')
+    args = sys.argv[1:]
+    if path and not _is_daemon(args):
+        try:
+            sock = _connect(path)
+        except OSError:
+            # No daemon running, run the command here
+            sock = None
+        if sock is not None:
+            sys.exit(forward(sock, args))
+    from pbs import cli
+    cli()
+
+
+def _is_daemon(args):
+    """Return whether args run the daemon command, e.g. pbs --server X daemon.
+
+    An option value named daemon is taken as the command too, which only
+    runs that command without the daemon.
+    """
+    return 'daemon' in args
+
+
+def _connect(path):
+    """Return a socket connected to the daemon of path."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def forward(sock, args, stdin=None, stdout=None, stderr=None):
+    """Run a pbs command in the daemon connected to sock.
+
+    The output of the command is written to stdout and stderr. Return its
+    exit code.
+    """
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    request = dict(args=args, cwd=os.getcwd())
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        for line in f:
+            message = json.loads(line.decode('utf-8'))
+            if 'exit' in message:
+                return message['exit']
+            if 'read' in message:
+                answer = _read_input(stdin, message)
+                f.write(json.dumps(answer).encode('utf-8') + b'\n')
+                f.flush()
+                continue
+            stream = stdout if 'out' in message else stderr
+            stream.write(message.get('out', message.get('err')))
+            stream.flush()
+    stderr.write("Error: the pbs daemon closed the connection\n")
+    return 1
+
+
+def _read_input(stdin, message):
+    """Return the answer to a read message of the daemon."""
+    size = message.get('size')
+    if size is None:
+        return dict(line=stdin.readline())
+    if message.get('binary'):
+        data = getattr(stdin, 'buffer', stdin).read(size)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return dict(data=base64.b64encode(data).decode('ascii'))
+    return dict(data=stdin.read(size))
+
+
+def create_server(path, run):
+    """Return a server that runs the commands of the clients of path.
+
+    run(args) runs a pbs command and returns its exit code, or raises the
+    click exceptions of the command. The commands run one at a time, in the
+    working directory of the client and with its input and output.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    if os.path.exists(path):
+        os.remove(path)
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            out = _Frames(self.wfile, 'out')
+            err = _Frames(self.wfile, 'err')
+            stdin = _Input(self.rfile, self.wfile)
+            with lock:
+                code = _run(run, request, stdin, out, err)
+            self.wfile.write(json.dumps(dict(exit=code)).encode('utf-8') +
+                             b'\n')
+
+    # Only the user can send commands, they run with their API key
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    return server
+
+
+def _run(run, request, stdin, out, err):
+    """Run a command of a client and return its exit code."""
+    import click
+    cwd = os.getcwd()
+    sys_stdin = sys.stdin
+    try:
+        os.chdir(request['cwd'])
+        sys.stdin = stdin
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                if _is_daemon(request['args']):
+                    raise click.UsageError("The pbs daemon cannot run the "
+                                           "daemon command")
+                code = run(request['args'])
+                return code if isinstance(code, int) else 0
+            except click.exceptions.Exit as e:
+                return e.exit_code
+            except click.ClickException as e:
+                e.show()
+                return e.exit_code
+            except click.Abort:
+                click.echo("Aborted!", err=True)
+                return 1
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                click.echo("Error: %r" % e, err=True)
+                return 1
+    except OSError as e:
+        err.write("Error: %s\n" % e)
+        return 1
+    finally:
+        sys.stdin = sys_stdin
+        os.chdir(cwd)
+
+
+class _Input(io.TextIOBase):
+
+    """Text stream that reads from the standard input of a client.
+
+    buffer has the rest of the input as bytes, e.g. for the Excel files, which
+    need to be sought.
+    """
+
+    # Size of the chunks of input asked to the client
+    chunk_size = 64 * 1024
+
+    def __init__(self, rfile, wfile):
+        """Init method."""
+        self.rfile = rfile
+        self.wfile = wfile
+        self._buffer = None
+
+    @property
+    def encoding(self):
+        # The client sends text, so click does not look for a binary stream
+        return 'utf-8'
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            data = io.BytesIO()
+            for chunk in iter(lambda: self._ask(size=self.chunk_size,
+                                                binary=True), ''):
+                data.write(base64.b64decode(chunk))
+            data.seek(0)
+            self._buffer = data
+        return self._buffer
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def _ask(self, key='data', **kwargs):
+        """Send a read message to the client and return its answer."""
+        message = dict(read=True, **kwargs)
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            return ''
+        return json.loads(line.decode('utf-8'))[key]
+
+    def readline(self, size=-1):
+        return self._ask('line')
+
+    def read(self, size=-1):
+        if size is not None and size >= 0:
+            return self._ask(size=size) if size else ''
+        return ''.join(iter(lambda: self._ask(size=self.chunk_size), ''))
+
+
+class _Frames(io.TextIOBase):
+
+    """Text stream that sends what is written as JSON lines."""
+
+    def __init__(self, wfile, key):
+        """Init method."""
+        self.wfile = wfile
+        self.key = key
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def write(self, data):
+        # click writes bytes to streams that are not a terminal
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        if data:
+            message = json.dumps({self.key: data}).encode('utf-8')
+            self.wfile.write(message + b'\n')
+        return len(data)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Local SQLite copy of the records of PYBOSSA projects.
+
+This module exports the following classes:
+    * Mirror: SQLite database with the tasks, taskruns and results of projects.
+
+Every table has the id of the records, the fields used to query them and the
+JSON of the whole record in the data column.
+"""
+import os
+import json
+import sqlite3
+import itertools
+import pbclient
+
+
+__all__ = ['Mirror', 'MIRROR_COLUMNS']
+
+
+# Queryable columns of every table, besides id and data
+MIRROR_COLUMNS = {
+    'tasks': ('project_id', 'state', 'n_answers', 'priority_0', 'created'),
+    'taskruns': ('project_id', 'task_id', 'user_id', 'finish_time'),
+    'results': ('project_id', 'task_id', 'last_version'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, state TEXT,
+    n_answers INTEGER, priority_0 REAL, created TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tasks_project ON tasks (project_id, state);
+CREATE TABLE IF NOT EXISTS taskruns (
+    id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, task_id INTEGER,
+    user_id INTEGER, finish_time TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS taskruns_project ON taskruns (project_id);
+CREATE INDEX IF NOT EXISTS taskruns_task ON taskruns (task_id);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, task_id INTEGER,
+    last_version INTEGER, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS results_project ON results (project_id);
+CREATE INDEX IF NOT EXISTS results_task ON results (task_id);
+"""
+
+# Ids per statement, below the SQLite limit of variables
+CHUNK = 500
+
+
+class Mirror(object):
+
+    """SQLite database with the tasks, taskruns and results of projects.
+
+    The records are only added or replaced, and the tasks state is derived
+    from the mirrored task runs, so it can be refreshed with the records
+    created since the last id of every table.
+    """
+
+    def __init__(self, path):
+        """Init method."""
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def last_id(self, kind, project_id):
+        """Return the id of the last record of a project, or None."""
+        row = self.db.execute('SELECT max(id) FROM %s WHERE project_id = ?' %
+                              kind, (project_id,)).fetchone()
+        return row[0]
+
+    def add(self, kind, records, batch=1000):
+        """Add or replace records and return how many were written.
+
+        Every batch of records is committed in one transaction.
+        """
+        columns = MIRROR_COLUMNS[kind]
+        sql = ('INSERT OR REPLACE INTO %s (id, %s, data) VALUES (?, %s, ?)' %
+               (kind, ', '.join(columns), ', '.join('?' for _ in columns)))
+        count = 0
+        records = iter(records)
+        while True:
+            rows = [[r.data['id']] + [r.data.get(c) for c in columns] +
+                    [json.dumps(r.data)]
+                    for r in itertools.islice(records, batch)]
+            if not rows:
+                return count
+            with self.db:
+                self.db.executemany(sql, rows)
+            count += len(rows)
+
+    def clear(self, kind, project_id):
+        """Remove the records of a project."""
+        with self.db:
+            self.db.execute('DELETE FROM %s WHERE project_id = ?' % kind,
+                            (project_id,))
+
+    def complete_tasks(self, project_id):
+        """Mark the tasks with all their task runs as completed."""
+        with self.db:
+            self.db.execute(
+                "UPDATE tasks SET state = 'completed' "
+                "WHERE project_id = ? AND state IS NOT 'completed' AND "
+                "n_answers <= (SELECT count(*) FROM taskruns "
+                "WHERE taskruns.task_id = tasks.id)", (project_id,))
+
+    def tasks(self, project_id, last_id=None):
+        """Yield the tasks of a project after last_id, sorted by id."""
+        rows = self.db.execute(
+            'SELECT data, state, n_answers FROM tasks '
+            'WHERE project_id = ? AND id > ? ORDER BY id',
+            (project_id, last_id or 0))
+        for data, state, n_answers in rows:
+            data = json.loads(data)
+            data.update(state=state, n_answers=n_answers)
+            yield pbclient.Task(data)
+
+    def taskruns(self, project_id):
+        """Yield the task runs of a project as dicts, sorted by id."""
+        rows = self.db.execute('SELECT data FROM taskruns '
+                               'WHERE project_id = ? ORDER BY id',
+                               (project_id,))
+        for data, in rows:
+            yield json.loads(data)
+
+    def remove_tasks(self, project_id, task_ids):
+        """Remove the tasks of task_ids with their task runs and results."""
+        task_ids = iter(task_ids)
+        while True:
+            chunk = list(itertools.islice(task_ids, CHUNK))
+            if not chunk:
+                return
+            marks = ', '.join('?' for _ in chunk)
+            with self.db:
+                self.db.execute('DELETE FROM tasks WHERE project_id = ? AND '
+                                'id IN (%s)' % marks, [project_id] + chunk)
+                for kind in ('taskruns', 'results'):
+                    self.db.execute('DELETE FROM %s WHERE project_id = ? AND '
+                                    'task_id IN (%s)' % (kind, marks),
+                                    [project_id] + chunk)
+
+    def set_n_answers(self, project_id, n_answers, task_ids=None):
+        """Set the redundancy of the tasks of task_ids, or of all of them.
+
+        The completed tasks that need more task runs are ongoing again.
+        """
+        sql = ("UPDATE tasks SET n_answers = ?1, state = CASE "
+               "WHEN ?1 > (SELECT count(*) FROM taskruns "
+               "WHERE taskruns.task_id = tasks.id) THEN 'ongoing' "
+               "ELSE state END WHERE project_id = ?2")
+        if task_ids is None:
+            with self.db:
+                self.db.execute(sql, (n_answers, project_id))
+            return
+        task_ids = iter(task_ids)
+        while True:
+            chunk = list(itertools.islice(task_ids, CHUNK))
+            if not chunk:
+                return
+            with self.db:
+                self.db.execute(sql + ' AND id IN (%s)' %
+                                ', '.join('?' for _ in chunk),
+                                [n_answers, project_id] + chunk)
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
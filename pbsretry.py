@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Retry transient failures of the PYBOSSA API.
+
+This module exports the following classes:
+    * RetryPolicy: retry calls with capped exponential backoff and jitter.
+    * DeadLetter: record the calls that failed after all the retries.
+"""
+import json
+import time
+import random
+import itertools
+import threading
+import pbclient
+from requests import exceptions
+from urllib3.exceptions import NewConnectionError
+
+
+__all__ = ['RetryPolicy', 'DeadLetter', 'retry_later']
+
+
+# Server errors worth retrying
+TRANSIENT_CODES = (429, 500, 502, 503, 504)
+
+# Answers that, with a Retry-After header, show the request was not processed
+RETRY_LATER_CODES = (429, 503)
+
+# Calls that can be sent twice without changing the result
+IDEMPOTENT = ('update_task', 'delete_task', 'update_project',
+              'update_helping_material')
+
+
+def status_code(response):
+    """Return the status code of a PYBOSSA error response, or None."""
+    if isinstance(response, dict):
+        return response.get('status_code') or response.get('code')
+    return None
+
+
+def retry_later(code):
+    """Return the error response of an answer with a Retry-After header."""
+    return dict(status='failed', status_code=code, exception_cls='HTTPError',
+                exception_msg='Retry-After', target='', retry_after=True)
+
+
+def server_failure(response=None, error=None):
+    """Return True if a call failed because of the server or the network."""
+    if error is None:
+        return status_code(response) in TRANSIENT_CODES
+    return isinstance(error, (exceptions.ConnectionError, exceptions.Timeout,
+                              ValueError))
+
+
+def request_not_sent(error):
+    """Return True if the request of a connection error never left pbs."""
+    if isinstance(error, exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class RetryPolicy(object):
+
+    """Retry transient failures with capped exponential backoff and jitter.
+
+    Failures are transient if the server answers with one of the
+    TRANSIENT_CODES or with a non JSON page (a proxy error), or if the
+    connection fails. The calls that are not IDEMPOTENT, like creating a
+    task, are only retried if the request was never sent or the server
+    asked to retry later (429, or 503 with Retry-After), as in any other
+    case it may have been processed and it would be created twice.
+    """
+
+    def __init__(self, retries=5, base=0.5, cap=60, sleep=time.sleep,
+                 jitter=random.random):
+        """Init method."""
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.sleep = sleep
+        self.jitter = jitter
+
+    def is_transient(self, method, response=None, error=None):
+        """Return True if the call failed and it can be retried."""
+        if not server_failure(response, error):
+            return False
+        if method in IDEMPOTENT:
+            return True
+        if error is not None:
+            return (isinstance(error, exceptions.ConnectionError) and
+                    request_not_sent(error))
+        code = status_code(response)
+        return code == 429 or (code in RETRY_LATER_CODES and
+                               bool(response.get('retry_after')))
+
+    def delay(self, attempt):
+        """Return the seconds to wait before the retry number attempt."""
+        return min(self.cap, self.base * 2 ** attempt) * self.jitter()
+
+    def call(self, method, func, kwargs, dead_letter=None):
+        """Return func(**kwargs), retrying its transient failures.
+
+        When the retries are exhausted, or the call failed and it cannot be
+        retried, the call is written to dead_letter and None is returned.
+        Without a dead_letter the last error is raised, or the last error
+        response is returned.
+        """
+        for attempt in itertools.count():
+            response, error = None, None
+            try:
+                response = func(**kwargs)
+            except (exceptions.RequestException, ValueError) as e:
+                error = e
+            done, result = self._settle(method, kwargs, attempt, response,
+                                        error, dead_letter)
+            if done:
+                return result
+            self.sleep(self.delay(attempt))
+
+    async def acall(self, method, func, kwargs, dead_letter=None):
+        """Like call, for a coroutine function func."""
+        import asyncio
+        for attempt in itertools.count():
+            response, error = None, None
+            try:
+                response = await func(**kwargs)
+            except (exceptions.RequestException, ValueError) as e:
+                error = e
+            done, result = self._settle(method, kwargs, attempt, response,
+                                        error, dead_letter)
+            if done:
+                return result
+            await asyncio.sleep(self.delay(attempt))
+
+    def _settle(self, method, kwargs, attempt, response, error, dead_letter):
+        """Return (True, result) for the last attempt, or (False, None)."""
+        transient = self.is_transient(method, response, error)
+        if transient and attempt < self.retries:
+            return False, None
+        # Including the failures that are not retried as they may be done
+        if dead_letter is not None and (transient or
+                                        server_failure(response, error)):
+            dead_letter.write(method, kwargs,
+                              response if error is None else error)
+            return True, None
+        if error is not None:
+            raise error
+        if (attempt and method == 'delete_task' and
+                status_code(response) == 404):
+            # A previous attempt deleted it
+            return True, True
+        return True, response
+
+
+class DeadLetter(object):
+
+    """JSON Lines file with the calls that failed after all the retries.
+
+    The file is only created if a call fails. The failed tasks keep their
+    info field, so the file can be imported again with --tasks-type jsonl.
+    """
+
+    def __init__(self, path):
+        """Init method."""
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, method, kwargs, error):
+        """Record a failed call."""
+        record = dict(method=method, error=str(error))
+        record.update(kwargs)
+        line = json.dumps(record, default=_serialize)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _serialize(obj):
+    """Return the data of pbclient domain objects."""
+    if isinstance(obj, pbclient.DomainObject):
+        return obj.data
+    return str(obj)
@@ -28,11 +28,14 @@ setup(
                    'License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)',
                    'Operating System :: OS Independent',
                    'Programming Language :: Python',],
-    py_modules=['pbs', 'helpers', 'pbsexceptions'],
+    py_modules=['pbs', 'helpers', 'pbsexceptions', 'asyncclient',
+                'pbsretry', 'pbsd', 'pbsmirror'],
     install_requires=['Click>=7.0, <7.1', 'pybossa-client>=3.0.0, <3.1.0', 'requests', 'nose', 'mock', 'coverage',
                       'rednose', 'pypandoc', 'simplejson', 'jsonschema', 'polib', 'watchdog', 'openpyxl'],
+    extras_require={'async': ['aiohttp'], 'yaml': ['pyyaml'],
+                    'aggregate': ['numpy']},
     entry_points='''
         [console_scripts]
-        pbs=pbs:cli
+        pbs=pbsd:main
     '''
 )
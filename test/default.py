@@ -23,10 +23,26 @@ class TestDefault(object):
     config = MagicMock()
     config.server = 'http://server'
     config.api_key = 'apikey'
+    config.refresh = False
     config.project = {'name': 'name',
                       'description': 'description',
                       'short_name': 'short_name'}
+    config.async_client = None
+    config.retry = None
+    config.project_cache = None
+    config.manifest = None
+    config.mirror = None
+
+    def setUp(self):
+        """Set up method."""
 
     def tearDown(self):
         """Tear down method."""
         self.error['status'] = 'failed'
+
+    # pytest does not call setUp and tearDown of plain classes
+    def setup_method(self, method):
+        self.setUp()
+
+    def teardown_method(self, method):
+        self.tearDown()
@@ -0,0 +1,136 @@
+"""Test module for pbs client."""
+import json
+from io import StringIO
+import threading
+import pbclient
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from default import TestDefault
+from helpers import _add_tasks, RateLimitGovernor
+from asyncclient import AsyncClient
+from pbsretry import RetryPolicy
+from mock import patch, MagicMock
+from nose.tools import assert_raises
+from requests import exceptions
+
+
+class FakePybossaHandler(BaseHTTPRequestHandler):
+
+    """Stand-in for the PYBOSSA task API."""
+
+    requests = []
+    # Number of requests answered with 503 and Retry-After
+    busy = 0
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('X-RateLimit-Remaining', '250')
+        self.send_header('X-RateLimit-Reset', '0')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def do_POST(self):
+        length = int(self.headers['content-length'])
+        task = json.loads(self.rfile.read(length).decode('utf-8'))
+        self.requests.append(('post', self.path))
+        if FakePybossaHandler.busy:
+            FakePybossaHandler.busy -= 1
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(b'<html>Busy</html>')
+            return
+        task['id'] = len(self.requests)
+        self._reply(200, json.dumps(task))
+
+    def do_DELETE(self):
+        self.requests.append(('delete', self.path))
+        self._reply(204, '')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncClient(TestDefault):
+
+    """Test class for the asyncio transport."""
+
+    def setUp(self):
+        """Start a local PYBOSSA stand-in."""
+        FakePybossaHandler.requests = []
+        FakePybossaHandler.busy = 0
+        self.server = HTTPServer(('127.0.0.1', 0), FakePybossaHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.endpoint = 'http://127.0.0.1:%s' % self.server.server_port
+        self.governor = RateLimitGovernor()
+        self.client = AsyncClient(self.endpoint, 'apikey', self.governor,
+                                  limit=4)
+
+    def tearDown(self):
+        """Stop the local PYBOSSA stand-in."""
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_map_create_task(self):
+        """Test AsyncClient.map creates tasks."""
+        calls = [(i, dict(project_id=1, info={'n': i})) for i in range(10)]
+        res = list(self.client.map('create_task', calls))
+        assert len(res) == 10, res
+        assert all(isinstance(r, pbclient.Task) for _, r in res)
+        assert all(tag == r.info['n'] for tag, r in res)
+        assert self.governor.remaining is not None
+
+    def test_map_delete_task(self):
+        """Test AsyncClient.map deletes tasks."""
+        calls = [(i, dict(task_id=i)) for i in range(3)]
+        res = sorted(self.client.map('delete_task', calls))
+        assert res == [(0, True), (1, True), (2, True)], res
+        paths = sorted(path for _, path in FakePybossaHandler.requests)
+        assert paths[0].startswith('/api/task/0?api_key=apikey'), paths
+
+    def test_map_close_waits_in_flight(self):
+        """Test AsyncClient.map finishes the requests in flight on close."""
+        calls = [(i, dict(project_id=1, info={'n': i})) for i in range(4)]
+        seen = []
+        res = self.client.map('create_task', calls,
+                              on_response=lambda tag, r: seen.append(tag))
+        next(res)
+        res.close()
+        assert sorted(seen) == [0, 1, 2, 3], seen
+        assert len(FakePybossaHandler.requests) == 4
+
+    def test_map_retry_later(self):
+        """Test AsyncClient.map retries creates the server asked to retry."""
+        FakePybossaHandler.busy = 1
+        calls = [(1, dict(project_id=1, info={'n': 1}))]
+        res = list(self.client.map('create_task', calls, RetryPolicy(base=0)))
+        assert isinstance(res[0][1], pbclient.Task), res
+        assert len(FakePybossaHandler.requests) == 2
+
+    def test_map_connection_error(self):
+        """Test AsyncClient.map raises requests ConnectionError."""
+        client = AsyncClient('http://127.0.0.1:1', None, self.governor)
+        calls = [(1, dict(task_id=1))]
+        assert_raises(exceptions.ConnectionError, list,
+                      client.map('delete_task', calls))
+        client.close()
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_async(self, find_mock):
+        """Test add_tasks with the async client works."""
+        project = MagicMock()
+        project.id = 1
+        find_mock.return_value = project
+        tasks = StringIO(json.dumps([{'key': i} for i in range(20)]))
+        config = MagicMock()
+        config.project = self.config.project
+        config.async_client = self.client
+        config.retry = None
+        config.project_cache = None
+        res = _add_tasks(config, tasks, 'json', 0, 30)
+        assert res == '20 tasks added to project: short_name', res
+        assert len(FakePybossaHandler.requests) == 20
+        assert not config.pbclient.create_task.called
@@ -7,6 +7,10 @@ from mock import patch, MagicMock
 from nose.tools import assert_raises
 from requests import exceptions
 from pbsexceptions import *
+import os
+import shutil
+import tempfile
+import threading
 import calendar
 import datetime
 
@@ -15,6 +19,15 @@ class TestHelpers(TestDefault):
 
     """Test class for pbs.helpers."""
 
+    def setUp(self):
+        """Create a temporary folder for the cache files."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary folder."""
+        shutil.rmtree(self.tmp)
+        super(TestHelpers, self).tearDown()
+
     @patch('pbclient.find_project')
     def test_find_project_by_short_name(self, mock):
         """Test find_project_by_short_name returns a project."""
@@ -129,6 +142,161 @@ class TestHelpers(TestDefault):
         assert sleep == 0, "Throttling should not be enabled"
         assert msg is None, "Throttling should not be enabled"
 
+    def test_rate_limit_governor_observe(self):
+        """Test RateLimitGovernor reads the rate-limit headers."""
+        governor = RateLimitGovernor()
+        response = MagicMock()
+        response.headers = {'X-RateLimit-Remaining': '42',
+                            'X-RateLimit-Reset': '1000'}
+        assert governor.observe(response) == response
+        assert governor.remaining == 42, governor.remaining
+        assert governor.reset == 1000, governor.reset
+
+    def test_call_api_retry_later(self):
+        """Test _call_api retries a create only if the server asked to."""
+        from helpers import _call_api
+        from pbsretry import RetryPolicy
+        config = MagicMock()
+        config.async_client = None
+        config.governor = RateLimitGovernor(clock=lambda: 100)
+        config.retry = RetryPolicy(sleep=lambda seconds: None)
+        answers = [503, 502]
+
+        def create_task(**kwargs):
+            # A proxy error page, with Retry-After only the first time
+            response = MagicMock(status_code=answers.pop(0))
+            response.headers = ({'Retry-After': '0'} if answers else {})
+            config.governor.observe(response)
+            raise ValueError('<html>')
+
+        config.pbclient.create_task.side_effect = create_task
+        assert_raises(ValueError, _call_api, config, 'create_task', info={})
+        assert answers == [], answers
+
+    def test_rate_limit_governor_does_not_wait(self):
+        """Test RateLimitGovernor consumes tokens without sleeping."""
+        sleep = MagicMock()
+        governor = RateLimitGovernor(clock=lambda: 100, sleep=sleep)
+        assert governor.wait() == 0
+        governor.remaining = 20
+        governor.reset = 200
+        assert governor.wait() == 0
+        assert governor.remaining == 19, governor.remaining
+        assert not sleep.called
+
+    def test_rate_limit_governor_waits_until_reset(self):
+        """Test RateLimitGovernor sleeps until the window is reset."""
+        now = [100]
+
+        def fake_sleep(seconds):
+            now[0] += seconds
+
+        governor = RateLimitGovernor(clock=lambda: now[0], sleep=fake_sleep)
+        governor.remaining = 5
+        governor.reset = 130
+        assert governor.wait() == 30
+        assert governor.remaining is None
+        assert governor.reset is None
+
+    def test_rate_limit_governor_retry_after(self):
+        """Test RateLimitGovernor waits as asked by a Retry-After header."""
+        governor = RateLimitGovernor(clock=lambda: 100)
+        response = MagicMock()
+        response.headers = {'Retry-After': '30'}
+        governor.observe(response)
+        assert governor.acquire() == 30
+        response.headers = {'Retry-After': 'Thu, 01 Jan 1970 00:03:00 GMT'}
+        governor.observe(response)
+        assert governor.acquire() == 80
+
+    def test_create_session(self):
+        """Test create_session hooks the governor into the responses."""
+        governor = RateLimitGovernor()
+        session = create_session(governor)
+        assert governor.observe in session.hooks['response']
+
+    def test_create_session_pool(self):
+        """Test create_session configures the connection pool."""
+        session = create_session(RateLimitGovernor(), pool_size=32,
+                                 keep_alive=False)
+        adapter = session.get_adapter('https://server')
+        assert adapter._pool_maxsize == 32, adapter._pool_maxsize
+        assert session.headers['Connection'] == 'close'
+
+    def test_enable_auto_throttling_uses_session(self):
+        """Test enable_auto_throttling sends the probe with the session."""
+        config = MagicMock()
+        config.server = 'http://server'
+        config.session.head.return_value.headers = {
+            'X-RateLimit-Remaining': 100}
+        sleep, msg = enable_auto_throttling(config, [])
+        config.session.head.assert_called_with('http://server/api/task')
+        assert sleep == 0, sleep
+
+    def test_bounded_map(self):
+        """Test _bounded_map applies the function to every item."""
+        from helpers import _bounded_map
+        res = list(_bounded_map(lambda x: x * 2, range(10)))
+        assert res == [x * 2 for x in range(10)], res
+        res = sorted(_bounded_map(lambda x: x * 2, range(100), workers=4))
+        assert res == [x * 2 for x in range(100)], res
+
+    def test_bounded_map_raises_errors(self):
+        """Test _bounded_map raises the errors of the workers."""
+        from helpers import _bounded_map
+
+        def fail(x):
+            raise exceptions.ConnectionError
+
+        assert_raises(exceptions.ConnectionError, list,
+                      _bounded_map(fail, range(10), workers=4))
+
+    def test_project_cache(self):
+        """Test ProjectCache keeps the projects for ttl seconds."""
+        now = [100]
+        path = os.path.join(self.tmp, 'projects', 'server.json')
+        cache = ProjectCache(path, ttl=60, clock=lambda: now[0])
+        assert cache.get('short_name') is None
+        cache.put('short_name', {'id': 1})
+        cache = ProjectCache(path, ttl=60, clock=lambda: now[0])
+        assert cache.get('short_name') == {'id': 1}
+        assert ProjectCache(path, refresh=True).get('short_name') is None
+        now[0] += 61
+        assert cache.get('short_name') is None
+        cache.remove('short_name')
+        assert ProjectCache(path).projects == {}
+        # The projects have the owner fields
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+    def test_create_project_cache(self):
+        """Test create_project_cache uses a file per server and credentials."""
+        cache_dir = self.tmp
+        default = create_project_cache('http://server', 'default',
+                                       cache_dir=cache_dir)
+        other = create_project_cache('http://server', 'other',
+                                     cache_dir=cache_dir)
+        assert default.path != other.path
+        assert os.path.dirname(default.path) == cache_dir
+
+    @patch('helpers.find_project_by_short_name')
+    def test_find_project_uses_cache(self, find_mock):
+        """Test _find_project only searches the server on a cache miss."""
+        from helpers import _find_project
+        find_mock.return_value = pbclient.Project(dict(id=1,
+                                                       short_name='short_name',
+                                                       info={}))
+        config = MagicMock()
+        config.project = {'short_name': 'short_name'}
+        config.pbclient = pbclient
+        path = os.path.join(self.tmp, 'server.json')
+        config.project_cache = ProjectCache(path)
+        assert _find_project(config).id == 1
+        project = _find_project(config)
+        assert project.id == 1
+        assert find_mock.call_count == 1
+        project.info['key'] = 'value'
+        assert _find_project(config).info == {}
+
     def test_pbs_handler(self):
         """Test PbsHandler patterns works."""
         obj = PbsHandler(None, None, None, None, None)
@@ -145,8 +313,70 @@ class TestHelpers(TestDefault):
         event = MagicMock()
         event.src_path = '/tmp/path.html'
         obj.on_modified(event)
-        mock.assert_called_with('config', 'task_presenter', 'results',
-                                'long_description', 'tutorial')
+        obj.on_modified(event)
+        obj.uploader.close()
+        mock.assert_called_once_with('config', 'task_presenter', 'results',
+                                     'long_description', 'tutorial', '')
+
+    def test_project_handlers(self):
+        """Test _project_handlers finds every project.json under root."""
+        from helpers import _project_handlers
+        root = self.tmp
+        for folder, content in [('a', {'short_name': 'a'}),
+                                (os.path.join('b', 'c'), {'short_name': 'c'}),
+                                ('bad', {'short_name': 1}),
+                                ('node_modules', {'short_name': 'x'})]:
+            os.makedirs(os.path.join(root, folder))
+            with open(os.path.join(root, folder, 'project.json'), 'w') as f:
+                json.dump(content, f)
+        config = MagicMock()
+        handlers = _project_handlers(config, root)
+        names = [h.config.project['short_name'] for _, h in handlers]
+        assert names == ['a', 'c'], names
+        folder, handler = handlers[1]
+        assert folder == os.path.join(root, 'b', 'c')
+        assert handler.task_presenter == os.path.join(folder, 'template.html')
+        assert handler.bundle_dir == folder
+        # The projects share the HTTP session
+        assert handler.config.session is config.session
+
+    def test_pbs_handler_dispatch(self):
+        """Test PbsHandler.dispatch only handles the watched files."""
+        obj = PbsHandler('config', 'task_presenter', 'results',
+                         'long_description', 'tutorial')
+        obj.on_modified = MagicMock()
+        event = MagicMock(is_directory=False, src_path='/tmp/other.html',
+                          dest_path=None, event_type='modified')
+        obj.dispatch(event)
+        assert not obj.on_modified.called
+        event.src_path = '/tmp/template.html'
+        obj.dispatch(event)
+        obj.on_modified.assert_called_once_with(event)
+        event.event_type = 'deleted'
+        obj.dispatch(event)
+        assert obj.on_modified.call_count == 1
+
+    def test_debounced_uploader(self):
+        """Test DebouncedUploader coalesces bursts and drops stale uploads."""
+        uploads = []
+        uploading = threading.Event()
+        release = threading.Event()
+
+        def upload():
+            uploads.append(len(uploads))
+            uploading.set()
+            release.wait(5)
+
+        uploader = DebouncedUploader(upload, delay=0.05)
+        for _ in range(10):
+            uploader.trigger()
+        assert uploading.wait(5)
+        # Events during an upload schedule only one more upload
+        for _ in range(10):
+            uploader.trigger()
+        release.set()
+        uploader.close()
+        assert uploads == [0, 1], uploads
 
     @patch('helpers.os.path.isfile')
     def test_update_bundle_js(self, mock):
@@ -1,4 +1,5 @@
 import json
+from io import StringIO
 from helpers import *
 from default import TestDefault
 from mock import patch, MagicMock
@@ -24,8 +25,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = json.dumps([{'info': {'key': 'value'}}])
+        helpingmaterials = StringIO(json.dumps([{'info': {'key': 'value'}}]))
 
         pbclient = MagicMock()
         pbclient.create_helpingmaterial.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -46,9 +46,8 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
+        helpingmaterials = StringIO(json.dumps([{'info': {'key': 'value'}}]))
         helpingmaterials.name = 'helpingmaterials.json'
-        helpingmaterials.read.return_value = json.dumps([{'info': {'key': 'value'}}])
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -69,8 +68,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = "info, value\n, %s, 2" % json.dumps({'key':'value'})
+        helpingmaterials = StringIO("info, value\n, %s, 2" % json.dumps({'key':'value'}))
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -78,7 +76,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
         res = _add_helpingmaterials(self.config, helpingmaterials, 'csv')
         assert res == '1 helping materials added to project: short_name', res
 
-    @patch('helpers.openpyxl.load_workbook')
+    @patch('openpyxl.load_workbook')
     @patch('helpers.find_project_by_short_name')
     @patch('helpers.enable_auto_throttling')
     def test_add_helping_materials_excel_with_info(self, auto_mock, find_mock, workbook_mock):
@@ -132,9 +130,8 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
+        helpingmaterials = StringIO("info, value\n, %s, 2" % json.dumps({'key':'value'}))
         helpingmaterials.name = 'helpingmaterials.csv'
-        helpingmaterials.read.return_value = "info, value\n, %s, 2" % json.dumps({'key':'value'})
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -156,8 +153,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = json.dumps([{'key': 'value'}])
+        helpingmaterials = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -179,8 +175,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = "key, value\n, 1, 2"
+        helpingmaterials = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -203,9 +198,8 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
+        helpingmaterials = StringIO("key, value\n, 1, 2")
         helpingmaterials.name = 'helping.doc'
-        helpingmaterials.read.return_value = "key, value\n, 1, 2"
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -228,8 +222,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = "key, value\n, 1, 2"
+        helpingmaterials = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_helping_material.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -252,8 +245,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        helpingmaterials = MagicMock()
-        helpingmaterials.read.return_value = "key, value\n, 1, 2"
+        helpingmaterials = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_helpingmaterial.side_effect = exceptions.ConnectionError
@@ -275,8 +267,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'key': 'value'}])
+        tasks = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_helpingmaterial.side_effect = exceptions.ConnectionError
@@ -297,8 +288,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'key': 'value'}])
+        tasks = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_helpingmaterial.return_value = self.error
@@ -323,7 +313,7 @@ class TestPbsAddHelpingMaterial(TestDefault):
         assert helping_info == dict(foo=1)
         assert file_path == 'file'
 
-    @patch('helpers.openpyxl.load_workbook')
+    @patch('openpyxl.load_workbook')
     @patch('helpers.find_project_by_short_name')
     @patch('helpers.enable_auto_throttling')
     def test_add_helping_materials_excel_with_file(self, auto_mock, find_mock, workbook_mock):
@@ -1,4 +1,10 @@
+import os
 import json
+import shutil
+import tempfile
+import time
+import click
+from io import StringIO
 from helpers import *
 from default import TestDefault
 from mock import patch, MagicMock
@@ -6,11 +12,21 @@ from nose.tools import assert_raises
 from requests import exceptions
 from pbsexceptions import *
 from openpyxl import Workbook
+from pbsretry import RetryPolicy
 
 class TestPbsAddTask(TestDefault):
 
     """Test class for pbs add tasks commands."""
 
+    def setUp(self):
+        """Create a temporary folder for the journals and indexes."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary folder."""
+        shutil.rmtree(self.tmp)
+        super(TestPbsAddTask, self).tearDown()
+
     @patch('helpers.find_project_by_short_name')
     @patch('helpers.enable_auto_throttling')
     def test_add_tasks_json_with_info(self, auto_mock, find_mock):
@@ -25,8 +41,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'info': {'key': 'value'}}])
+        tasks = StringIO(json.dumps([{'info': {'key': 'value'}}]))
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -48,9 +63,8 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
+        tasks = StringIO(json.dumps([{'info': {'key': 'value'}}]))
         tasks.name = 'tasks.json'
-        tasks.read.return_value = json.dumps([{'info': {'key': 'value'}}])
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -71,8 +85,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = "info, value\n, %s, 2" % json.dumps({'key':'value'})
+        tasks = StringIO("info, value\n, %s, 2" % json.dumps({'key':'value'}))
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -80,7 +93,7 @@ class TestPbsAddTask(TestDefault):
         res = _add_tasks(self.config, tasks, 'csv', 0, 30)
         assert res == '1 tasks added to project: short_name', res
 
-    @patch('helpers.openpyxl.load_workbook')
+    @patch('openpyxl.load_workbook')
     @patch('helpers.find_project_by_short_name')
     @patch('helpers.enable_auto_throttling')
     def test_add_tasks_excel_with_info(self, auto_mock, find_mock, workbook_mock):
@@ -140,9 +153,8 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
+        tasks = StringIO("info, value\n, %s, 2" % json.dumps({'key':'value'}))
         tasks.name = 'tasks.csv'
-        tasks.read.return_value = "info, value\n, %s, 2" % json.dumps({'key':'value'})
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -164,8 +176,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'key': 'value'}])
+        tasks = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -187,8 +198,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = "key, value\n, 1, 2"
+        tasks = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -209,9 +219,8 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
+        tasks = StringIO("key, value\n, 1, 2")
         tasks.name = 'tasks.doc'
-        tasks.read.return_value = "key, value\n, 1, 2"
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -234,8 +243,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = "key, value\n, 1, 2"
+        tasks = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
@@ -258,8 +266,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = "key, value\n, 1, 2"
+        tasks = StringIO("key, value\n, 1, 2")
 
         pbclient = MagicMock()
         pbclient.create_task.side_effect = exceptions.ConnectionError
@@ -281,8 +288,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'key': 'value'}])
+        tasks = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_task.side_effect = exceptions.ConnectionError
@@ -304,8 +310,7 @@ class TestPbsAddTask(TestDefault):
 
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = json.dumps([{'key': 'value'}])
+        tasks = StringIO(json.dumps([{'key': 'value'}]))
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = self.error
@@ -391,8 +396,7 @@ class TestPbsAddTask(TestDefault):
         project.info = dict()
         find_mock.return_value = project
 
-        tasks = MagicMock()
-        tasks.read.return_value = "foo_id= foo\n"
+        tasks = StringIO("foo_id= foo\n")
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'var_id': 'foo_id',
@@ -414,9 +418,8 @@ class TestPbsAddTask(TestDefault):
         project.info = dict()
         find_mock.return_value = project
 
-        tasks = MagicMock()
+        tasks = StringIO("foo_id= foo\n")
         tasks.name = 'tasks.properties'
-        tasks.read.return_value = "foo_id= foo\n"
 
         pbclient = MagicMock()
         pbclient.create_task.return_value = {'id': 1, 'info': {'var_id': 'foo_id',
@@ -425,6 +428,351 @@ class TestPbsAddTask(TestDefault):
         res = _add_tasks(self.config, tasks, None, 0, 30)
         assert res == '1 tasks added to project: short_name', res
 
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_json_with_workers(self, find_mock):
+        """Test add_tasks json with several workers works."""
+        project = MagicMock()
+        project.id = 1
+        find_mock.return_value = project
+
+        tasks = StringIO(json.dumps([{'key': i} for i in range(50)]))
+
+        pbclient = MagicMock()
+        pbclient.create_task.return_value = {'id': 1, 'info': {'key': 'value'}}
+        self.config.pbclient = pbclient
+        res = _add_tasks(self.config, tasks, 'json', 0, 30, workers=8)
+        assert res == '50 tasks added to project: short_name', res
+        assert pbclient.create_task.call_count == 50
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_json_with_workers_connection_error(self, find_mock):
+        """Test add_tasks with several workers connection error works."""
+        find_mock.return_value = MagicMock()
+
+        tasks = StringIO(json.dumps([{'key': i} for i in range(50)]))
+
+        pbclient = MagicMock()
+        pbclient.create_task.side_effect = exceptions.ConnectionError
+        self.config.pbclient = pbclient
+        res = _add_tasks(self.config, tasks, 'json', 0, 30, workers=4)
+        assert res == "Connection Error! The server http://server is not responding", res
+
+    def test_load_data_is_lazy(self):
+        """Test _load_data yields the rows one by one."""
+        from helpers import _load_data
+        tasks = StringIO("key,value\n1,2\n3,4\n")
+        data = _load_data(tasks, 'csv')
+        assert next(data) == {'key': '1', 'value': '2'}
+        assert list(data) == [{'key': '3', 'value': '4'}]
+        assert list(_load_data(tasks, 'doc')) == []
+
+    def test_load_json_in_chunks(self):
+        """Test the JSON array is decoded item by item across chunks."""
+        from helpers import _load_json
+        rows = [{'info': {'n': i, 'text': 'a, [b] "c"'}} for i in range(100)]
+        rows += [12345, 'str', None, [1, 2]]
+        tasks = StringIO(' \n' + json.dumps(rows, indent=2))
+        res = list(_load_json(tasks, chunk_size=7))
+        assert res == rows, res
+
+    def test_load_json_not_an_array(self):
+        """Test _load_json falls back for non array documents."""
+        from helpers import _load_json
+        assert list(_load_json(StringIO('[]'))) == []
+        assert list(_load_json(StringIO('{"a": 1}'))) == ['a']
+
+    def test_load_json_truncated(self):
+        """Test _load_json raises ValueError for a truncated array."""
+        from helpers import _load_json
+        tasks = StringIO('[{"a": 1}, {"b"')
+        assert_raises(ValueError, list, _load_json(tasks, chunk_size=4))
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_jsonl(self, find_mock):
+        """Test add_tasks JSON Lines works."""
+        find_mock.return_value = MagicMock()
+
+        tasks = StringIO('{"info": {"key": 1}}\n\n{"key": 2}\n')
+        tasks.name = 'tasks.ndjson'
+
+        pbclient = MagicMock()
+        pbclient.create_task.return_value = {'id': 1, 'info': {'key': 2}}
+        self.config.pbclient = pbclient
+        res = _add_tasks(self.config, tasks, None, 0, 30)
+        assert res == '2 tasks added to project: short_name', res
+        pbclient.create_task.assert_called_with(project_id=find_mock().id,
+                                                info={'key': 2},
+                                                n_answers=30,
+                                                priority_0=0)
+
+    def test_load_excel_sheets(self):
+        """Test the Excel loader reads the selected sheets."""
+        from helpers import _load_data
+        wb = Workbook()
+        ws = wb.active
+        ws.title = 'first'
+        ws.append(['Column Name', 'foo'])
+        ws.append(['value', 'bar'])
+        ws.append([None, None])
+        ws.append(['short'])
+        ws = wb.create_sheet('second')
+        ws.append(['Other Column'])
+        ws.append(['other'])
+        file_name = os.path.join(self.tmp, 'sheets.xlsx')
+        wb.save(file_name)
+
+        with open(file_name, 'rb') as f:
+            res = list(_load_data(f, 'xlsx'))
+        assert res == [{'column_name': 'value', 'foo': 'bar'},
+                       {'column_name': 'short', 'foo': None}], res
+
+        with open(file_name, 'rb') as f:
+            res = list(_load_data(f, 'xlsx', sheet='second'))
+        assert res == [{'other_column': 'other'}], res
+
+        with open(file_name, 'rb') as f:
+            res = list(_load_data(f, 'xlsx', sheet='*'))
+        assert len(res) == 3, res
+        assert res[-1] == {'other_column': 'other'}, res
+
+        with open(file_name, 'rb') as f:
+            with assert_raises(click.BadParameter) as cm:
+                list(_load_data(f, 'xlsx', sheet='third'))
+        assert 'first, second' in cm.exception.message, cm.exception.message
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_resume(self, find_mock):
+        """Test add_tasks resumes from the first row not created."""
+        find_mock.return_value = MagicMock()
+        journal_dir = self.tmp
+        file_name = os.path.join(journal_dir, 'tasks.csv')
+        with open(file_name, 'w') as f:
+            f.write("key,value\n")
+            for i in range(10):
+                f.write("%s,%s\n" % (i, i * 2))
+
+        created = []
+
+        def create_task(**kwargs):
+            if len(created) == 4:
+                raise exceptions.ConnectionError
+            created.append(kwargs['info']['key'])
+            return {'id': 1}
+
+        pbclient = MagicMock()
+        pbclient.create_task.side_effect = create_task
+        self.config.pbclient = pbclient
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30,
+                             journal_dir=journal_dir)
+        assert res == "Connection Error! The server http://server is not responding", res
+        assert created == ['0', '1', '2', '3'], created
+
+        pbclient.create_task.side_effect = None
+        pbclient.create_task.return_value = {'id': 1}
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30, resume=True,
+                             journal_dir=journal_dir)
+        assert res == '6 tasks added to project: short_name', res
+        infos = [c[1]['info'] for c in pbclient.create_task.call_args_list[-6:]]
+        assert infos[0] == {'key': '4', 'value': '8'}, infos
+        assert infos[-1] == {'key': '9', 'value': '18'}, infos
+        assert os.listdir(journal_dir) == ['tasks.csv'], os.listdir(journal_dir)
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_resume_workers(self, find_mock):
+        """Test add_tasks resumes without the rows created after a failure."""
+        find_mock.return_value = MagicMock()
+        journal_dir = self.tmp
+        file_name = os.path.join(journal_dir, 'tasks.csv')
+        with open(file_name, 'w') as f:
+            f.write("key,value\n")
+            for i in range(10):
+                f.write("%s,%s\n" % (i, i * 2))
+
+        created = []
+
+        def create_task(**kwargs):
+            if kwargs['info']['key'] == '2':
+                # The other rows finish first
+                time.sleep(0.2)
+                raise exceptions.ConnectionError
+            created.append(kwargs['info']['key'])
+            return {'id': 1}
+
+        pbclient = MagicMock()
+        pbclient.create_task.side_effect = create_task
+        self.config.pbclient = pbclient
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30, workers=4,
+                             journal_dir=journal_dir)
+        assert res == "Connection Error! The server http://server is not responding", res
+        assert len(created) == 9, created
+
+        pbclient.create_task.side_effect = None
+        pbclient.create_task.return_value = {'id': 1}
+        pbclient.create_task.reset_mock()
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30, workers=4,
+                             resume=True, journal_dir=journal_dir)
+        assert res == '1 tasks added to project: short_name', res
+        infos = [c[1]['info'] for c in pbclient.create_task.call_args_list]
+        assert infos == [{'key': '2', 'value': '4'}], infos
+        assert os.listdir(journal_dir) == ['tasks.csv'], os.listdir(journal_dir)
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_resume_workers_in_flight(self, find_mock):
+        """Test add_tasks records the rows in flight when a row fails."""
+        find_mock.return_value = MagicMock()
+        journal_dir = self.tmp
+        file_name = os.path.join(journal_dir, 'tasks.csv')
+        with open(file_name, 'w') as f:
+            f.write("key,value\n")
+            for i in range(20):
+                f.write("%s,%s\n" % (i, i * 2))
+
+        created = []
+
+        def create_task(**kwargs):
+            if kwargs['info']['key'] == '0':
+                raise exceptions.ConnectionError
+            # The other rows are still being sent when the first one fails
+            time.sleep(0.2)
+            created.append(kwargs['info']['key'])
+            return {'id': 1}
+
+        pbclient = MagicMock()
+        pbclient.create_task.side_effect = create_task
+        self.config.pbclient = pbclient
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30, workers=4,
+                             journal_dir=journal_dir)
+        assert res == "Connection Error! The server http://server is not responding", res
+        assert len(created) >= 3, created
+
+        first_run = list(created)
+        pbclient.create_task.side_effect = None
+        pbclient.create_task.return_value = {'id': 1}
+        pbclient.create_task.reset_mock()
+        with open(file_name) as tasks:
+            res = _add_tasks(self.config, tasks, None, 0, 30, workers=4,
+                             resume=True, journal_dir=journal_dir)
+        keys = [c[1]['info']['key']
+                for c in pbclient.create_task.call_args_list]
+        assert not set(keys) & set(first_run), (keys, first_run)
+        assert sorted(keys + first_run, key=int) == [str(i) for i in range(20)], keys
+        assert os.listdir(journal_dir) == ['tasks.csv'], os.listdir(journal_dir)
+
+    def test_task_journal(self):
+        """Test TaskJournal only commits the finished prefix of rows."""
+        path = os.path.join(self.tmp, 'journal', 'p.json')
+        journal = TaskJournal(path, 'hash', interval=0)
+        journal.done(1, 20)
+        assert journal.rows == 0, journal.rows
+        journal.done(0, 10)
+        assert journal.rows == 2 and journal.offset == 20
+        journal = TaskJournal(path, 'hash')
+        assert (journal.rows, journal.offset) == (2, 20)
+        journal.done(4, 50)
+        journal.done(5, 60)
+        journal.done(7, 80)
+        journal.save()
+        journal = TaskJournal(path, 'hash')
+        assert journal.created == set([4, 5, 7]), journal.created
+        journal = TaskJournal(path, 'another file')
+        assert (journal.rows, journal.offset) == (0, 0)
+        assert journal.created == set()
+        journal.remove()
+        assert not os.path.exists(path)
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_dedup(self, find_mock):
+        """Test add_tasks skips the tasks already in the project."""
+        project = MagicMock()
+        project.id = 1
+        find_mock.return_value = project
+        index_dir = self.tmp
+
+        existing = MagicMock()
+        existing.id = 10
+        existing.info = {'key': 1}
+
+        def get_tasks(project_id, limit, last_id):
+            if last_id < 10:
+                return [existing]
+            return []
+
+        pbclient = MagicMock()
+        pbclient.get_tasks.side_effect = get_tasks
+        pbclient.create_task.return_value = {'id': 11}
+        self.config.pbclient = pbclient
+        rows = [{'key': 1}, {'key': 2}, {'info': {'key': 2}}, {'key': 3}]
+        res = _add_tasks(self.config, StringIO(json.dumps(rows)), 'json', 0,
+                         30, dedup=True, index_dir=index_dir)
+        msg = ('2 tasks added to project: short_name '
+               '(2 already in the project skipped)')
+        assert res == msg, res
+        infos = [c[1]['info'] for c in pbclient.create_task.call_args_list]
+        assert infos == [{'key': 2}, {'key': 3}], infos
+
+        # The index is cached, only the new tasks are requested
+        pbclient.get_tasks.reset_mock()
+        res = _add_tasks(self.config, StringIO(json.dumps(rows)), 'json', 0,
+                         30, dedup=True, index_dir=index_dir)
+        assert res.startswith('0 tasks added'), res
+        pbclient.get_tasks.assert_called_once_with(1, limit=100, last_id=10)
+
+        # With --refresh the index is built again, e.g. after deleting tasks
+        pbclient.get_tasks.side_effect = lambda project_id, limit, last_id: []
+        pbclient.get_tasks.reset_mock()
+        pbclient.create_task.reset_mock()
+        self.config.refresh = True
+        try:
+            res = _add_tasks(self.config, StringIO(json.dumps(rows)), 'json',
+                             0, 30, dedup=True, index_dir=index_dir)
+        finally:
+            self.config.refresh = False
+        assert res.startswith('3 tasks added'), res
+        pbclient.get_tasks.assert_called_once_with(1, limit=100, last_id=0)
+
+    @patch('helpers.find_project_by_short_name')
+    def test_add_tasks_dead_letter(self, find_mock):
+        """Test add_tasks saves the tasks that keep failing and goes on."""
+        project = MagicMock()
+        project.id = 1
+        find_mock.return_value = project
+        path = os.path.join(self.tmp, 'failed.jsonl')
+        # Creates are only retried when the server asks to with Retry-After
+        unavailable = {'status': 'failed', 'status_code': 503,
+                       'retry_after': True}
+
+        def create_task(**kwargs):
+            if kwargs['info']['key'] == 1:
+                return unavailable
+            return {'id': 1}
+
+        pbclient = MagicMock()
+        pbclient.create_task.side_effect = create_task
+        self.config.pbclient = pbclient
+        self.config.retry = RetryPolicy(2, sleep=lambda seconds: None)
+        try:
+            rows = [{'key': i} for i in range(3)]
+            res = _add_tasks(self.config, StringIO(json.dumps(rows)), 'json',
+                             0, 30, workers=2, dead_letter=path)
+        finally:
+            self.config.retry = None
+        msg = ('2 tasks added to project: short_name. '
+               '1 tasks failed and were saved in %s' % path)
+        assert res == msg, res
+        assert pbclient.create_task.call_count == 5
+        with open(path) as f:
+            assert json.loads(f.read())['info'] == {'key': 1}
+
+    def test_task_hash(self):
+        """Test task_hash does not depend on the order of the keys."""
+        assert task_hash({'a': 1, 'b': 2}) == task_hash({'b': 2, 'a': 1})
+        assert task_hash({'a': 1}) != task_hash({'a': '1'})
+
     def test_empty_row(self):
         """Test that empty_row method detects it properly."""
         empty = [None, None, None, None]
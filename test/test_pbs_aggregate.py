@@ -0,0 +1,116 @@
+"""Test module for pbs client."""
+import os
+import csv
+import json
+import math
+import shutil
+import tempfile
+from io import StringIO
+from helpers import *
+from helpers import _consensus
+from pbsmirror import Mirror
+from default import TestDefault
+from mock import patch, MagicMock
+from unittest import SkipTest
+import pbclient
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestPbsAggregate(TestDefault):
+
+    """Test class for pbs aggregate command."""
+
+    runs = [dict(id=1, task_id=2, info=dict(answer='yes')),
+            dict(id=2, task_id=1, info=dict(answer='no')),
+            dict(id=3, task_id=2, info=dict(answer='no')),
+            dict(id=4, task_id=2, info=dict(answer='yes')),
+            dict(id=5, task_id=3, info=dict(answer='no')),
+            dict(id=6, task_id=3, info=dict(answer='yes'))]
+
+    def setUp(self):
+        """Create the output folder."""
+        if np is None:
+            raise SkipTest("numpy is required: "
+                           "pip install pybossa-pbs[aggregate]")
+        self.tmp = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp, 'aggregate')
+
+    def tearDown(self):
+        """Remove the output folder."""
+        shutil.rmtree(self.tmp)
+
+    def taskruns_file(self):
+        return StringIO(''.join(json.dumps(r) + '\n' for r in self.runs))
+
+    def test_consensus(self):
+        """Test consensus computes the statistics of every task."""
+        tasks, n_taskruns, n_distinct, codes, agreement, entropy = \
+            _consensus(np, [2, 1, 2, 2, 3, 3], [0, 1, 1, 0, 1, 0])
+        assert list(tasks) == [1, 2, 3], tasks
+        assert list(n_taskruns) == [1, 3, 2], n_taskruns
+        assert list(n_distinct) == [1, 2, 2], n_distinct
+        # A tie goes to the answer seen first
+        assert list(codes) == [1, 0, 0], codes
+        assert np.allclose(agreement, [1, 2 / 3.0, 0.5]), agreement
+        h = -(2 / 3.0) * math.log2(2 / 3.0) - (1 / 3.0) * math.log2(1 / 3.0)
+        assert np.allclose(entropy, [0, h, 1]), entropy
+        assert len(_consensus(np, [], [])[0]) == 0
+
+    def test_aggregate_file(self):
+        """Test aggregate writes the consensus of a task runs file."""
+        res = _aggregate(self.config, self.output, field='answer',
+                         taskruns_file=self.taskruns_file())
+        assert res == "3 tasks aggregated to %s" % self.output, res
+        with open(self.output) as f:
+            rows = [json.loads(line) for line in f]
+        assert [(r['task_id'], r['answer'], r['n_taskruns'],
+                 r['n_distinct_answers'])
+                for r in rows] == [(1, 'no', 1, 1), (2, 'yes', 3, 2),
+                                   (3, 'yes', 2, 2)], rows
+        assert 'n_answers' not in rows[0], rows
+        assert rows[2]['entropy'] == 1.0, rows
+
+    @patch('helpers.find_project_by_short_name')
+    def test_aggregate_mirror(self, find_mock):
+        """Test aggregate reads the task runs from the mirror."""
+        find_mock.return_value = MagicMock(id=1)
+        mirror = Mirror(os.path.join(self.tmp, 'mirror.sqlite'))
+        self.config.mirror = mirror
+        self.config.pbclient = MagicMock()
+        runs = [pbclient.TaskRun(dict(r, project_id=1)) for r in self.runs]
+        self.config.pbclient.get_taskruns.side_effect = \
+            lambda project_id, limit, last_id: runs if not last_id else []
+        try:
+            res = _aggregate(self.config, self.output, 'csv')
+        finally:
+            self.config.mirror = None
+            mirror.close()
+        assert res == "3 tasks aggregated to %s" % self.output, res
+        with open(self.output) as f:
+            rows = list(csv.DictReader(f))
+        assert json.loads(rows[1]['answer']) == dict(answer='yes'), rows
+        assert rows[1]['agreement'].startswith('0.666'), rows
+
+    def test_aggregate_mirror_stdout(self):
+        """Test aggregate to stdout only writes the consensus there."""
+        mirror = Mirror(os.path.join(self.tmp, 'mirror.sqlite'))
+        self.config.mirror = mirror
+        self.config.pbclient = MagicMock()
+        self.config.pbclient.find_project.return_value = [
+            pbclient.Project(dict(id=1, short_name='short_name'))]
+        runs = [pbclient.TaskRun(dict(r, project_id=1)) for r in self.runs]
+        self.config.pbclient.get_taskruns.side_effect = \
+            lambda project_id, limit, last_id: runs if not last_id else []
+        try:
+            with patch('sys.stdout', new_callable=StringIO) as stdout, \
+                    patch('sys.stderr', new_callable=StringIO):
+                _aggregate(self.config, '-', field='answer')
+        finally:
+            self.config.mirror = None
+            mirror.close()
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert [r['task_id'] for r in rows] == [1, 2, 3], rows
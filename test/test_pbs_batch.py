@@ -0,0 +1,145 @@
+"""Test module for pbs client."""
+import os
+import json
+import shutil
+import tempfile
+from io import StringIO
+from helpers import *
+from default import TestDefault
+from mock import patch, MagicMock
+from nose.tools import assert_raises
+from pbsexceptions import ProjectNotFound
+import click
+
+
+class TestPbsBatch(TestDefault):
+
+    """Test class for pbs batch command."""
+
+    def setUp(self):
+        """Create a temporary folder for the projects."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary folder."""
+        shutil.rmtree(self.tmp)
+        super(TestPbsBatch, self).tearDown()
+
+    def manifest(self, operations, name='batch.json'):
+        f = StringIO(json.dumps(operations))
+        f.name = name
+        return f
+
+    def write_project(self, root, short_name):
+        folder = os.path.join(root, short_name)
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'project.json'), 'w') as f:
+            json.dump(dict(name=short_name, short_name=short_name,
+                           description=short_name), f)
+        return os.path.join(short_name, 'project.json')
+
+    def test_load_batch(self):
+        """Test _load_batch normalizes the operations."""
+        ops = _load_batch(self.manifest({'operations': [
+            {'project': 'a/project.json', 'command': 'add-tasks',
+             'tasks_file': 'tasks.csv', 'redundancy': 3},
+            {'command': 'update_project'}]}))
+        assert ops[0]['command'] == 'add_tasks', ops
+        assert ops[1]['project'] == 'project.json', ops
+
+    def test_load_batch_errors(self):
+        """Test _load_batch checks the commands and their options."""
+        assert_raises(click.UsageError, _load_batch,
+                      self.manifest([{'command': 'unknown'}]))
+        assert_raises(click.UsageError, _load_batch,
+                      self.manifest([{'command': 'add_tasks'}]))
+        assert_raises(click.UsageError, _load_batch,
+                      self.manifest([{'command': 'delete_tasks',
+                                      'colour': 'red'}]))
+        assert_raises(click.UsageError, _load_batch, self.manifest({}))
+
+    def test_load_batch_yaml(self):
+        """Test _load_batch reads YAML manifests."""
+        try:
+            import yaml
+        except ImportError:
+            return
+        f = StringIO("- project: a/project.json\n"
+                     "  command: update-task-redundancy\n"
+                     "  redundancy: 5\n")
+        f.name = 'batch.yaml'
+        ops = _load_batch(f)
+        assert ops == [{'project': 'a/project.json',
+                        'command': 'update_task_redundancy',
+                        'redundancy': 5}], ops
+
+    @patch('helpers._update_project')
+    @patch('helpers._create_project')
+    def test_run_batch(self, create_mock, update_mock):
+        """Test _run_batch runs the operations of every project in order."""
+        root = self.tmp
+        a = self.write_project(root, 'a')
+        b = self.write_project(root, 'b')
+        calls = []
+
+        def create(config):
+            calls.append(('create', config.project['short_name']))
+            if config.project['short_name'] == 'b':
+                raise ValueError('boom')
+            return 'created'
+
+        def update(config, *args, **kwargs):
+            calls.append(('update', config.project['short_name']))
+            return 'updated'
+
+        create_mock.side_effect = create
+        update_mock.side_effect = update
+        ops = _load_batch(self.manifest([
+            {'project': a, 'command': 'create_project'},
+            {'project': b, 'command': 'create_project'},
+            {'project': a, 'command': 'update_project'},
+            {'project': b, 'command': 'update_project'},
+            {'project': 'missing/project.json', 'command': 'create_project'}]))
+        failed = _run_batch(self.config, ops, root, workers=2)
+        # b stops at its first error, and the missing project does not run
+        assert failed == 3, failed
+        assert sorted(calls) == [('create', 'a'), ('create', 'b'),
+                                 ('update', 'a')], calls
+        args, kwargs = update_mock.call_args
+        assert args[1] == os.path.join(root, 'a', 'template.html'), args
+        assert kwargs == dict(bundle_dir=os.path.join(root, 'a')), kwargs
+
+    @patch('helpers.find_project_by_short_name')
+    def test_run_batch_failures(self, find_mock):
+        """Test _run_batch stops at the failures reported in the message."""
+        root = self.tmp
+        a = self.write_project(root, 'a')
+        b = self.write_project(root, 'b')
+        with open(os.path.join(root, 'b', 'tasks.csv'), 'w') as f:
+            f.write('')
+
+        def find(short_name, pbclient, all=None):
+            if short_name == 'a':
+                raise ProjectNotFound(message='missing', error=self.error)
+            return MagicMock(id=1)
+
+        find_mock.side_effect = find
+        config = MagicMock()
+        config.async_client = None
+        config.retry = None
+        config.project_cache = None
+        config.manifest = None
+        config.mirror = None
+        ops = _load_batch(self.manifest([
+            {'project': a, 'command': 'update_project'},
+            {'project': a, 'command': 'delete_tasks', 'task_id': 1},
+            {'project': b, 'command': 'add_tasks', 'tasks_file': 'tasks.csv',
+             'tasks_type': 'csv'},
+            {'project': b, 'command': 'delete_tasks', 'task_id': 1}]))
+        with patch('helpers.click.secho') as secho:
+            failed = _run_batch(config, ops, root, workers=1)
+        assert failed == 4, failed
+        assert not config.pbclient.delete_task.called
+        errors = sorted(c[0][0] for c in secho.call_args_list)
+        assert 'Project not found!' in errors[0], errors
+        assert 'Unknown format' in errors[1], errors
@@ -7,6 +7,7 @@ from mock import patch, MagicMock
 from nose.tools import assert_raises
 from requests import exceptions
 from pbsexceptions import ProjectNotFound
+from pbsretry import RetryPolicy
 
 
 class TestPbsCreateProject(TestDefault):
@@ -29,6 +30,23 @@ class TestPbsCreateProject(TestDefault):
         res = _create_project(self.config)
         assert res == "Connection Error! The server http://server is not responding", res
 
+    def test_create_project_retry(self):
+        """Test create_project retries when the server asks to retry later."""
+        pbclient = MagicMock()
+        busy = dict(status='failed', status_code=429, target='project',
+                    exception_cls='HTTPError')
+        pbclient.create_project.side_effect = [busy, {'short_name': 'short_name'}]
+        self.config.pbclient = pbclient
+        self.config.retry = RetryPolicy(2, sleep=lambda seconds: None)
+        try:
+            res = _create_project(self.config)
+        finally:
+            self.config.retry = None
+        assert res == 'Project: short_name created!', res
+        assert pbclient.create_project.call_count == 2
+        pbclient.create_project.assert_called_with('name', 'short_name',
+                                                   'description')
+
     def test_create_project_another_error(self):
         """Test create_project another error works."""
         pbclient = MagicMock()
@@ -48,9 +48,65 @@ class TestPbsDeleteTask(TestDefault):
         pbclient.get_tasks.side_effect = [[task], []]
         self.config.pbclient = pbclient
 
-        res = _delete_tasks(self.config, None, limit=1, offset=0)
+        res = _delete_tasks(self.config, None, limit=1)
         assert res == "All tasks and task_runs have been deleted", res
 
+    @patch('helpers.find_project_by_short_name')
+    def test_delete_all_tasks_pages(self, find_mock):
+        """Test delete all tasks visits every task once across pages."""
+        find_mock.return_value = MagicMock()
+        server = []
+        for i in range(1, 251):
+            task = MagicMock()
+            task.id = i
+            server.append(task)
+
+        def get_tasks(project_id, limit, last_id):
+            return [t for t in server if t.id > last_id][:limit]
+
+        deleted = []
+
+        def delete_task(task_id):
+            deleted.append(task_id)
+            server[:] = [t for t in server if t.id != task_id]
+            return True
+
+        pbclient = MagicMock()
+        pbclient.get_tasks.side_effect = get_tasks
+        pbclient.delete_task.side_effect = delete_task
+        self.config.pbclient = pbclient
+
+        res = _delete_tasks(self.config, None, limit=100)
+        assert res == "All tasks and task_runs have been deleted", res
+        assert deleted == list(range(1, 251)), deleted
+        assert server == []
+        # The last page is the empty one
+        assert pbclient.get_tasks.call_count == 4
+
+    @patch('helpers.find_project_by_short_name')
+    def test_delete_all_tasks_workers(self, find_mock):
+        """Test delete all tasks with several workers works."""
+        find_mock.return_value = MagicMock()
+        tasks = []
+        for i in range(1, 251):
+            task = MagicMock()
+            task.id = i
+            tasks.append(task)
+
+        def get_tasks(project_id, limit, last_id):
+            return [t for t in tasks if t.id > last_id][:limit]
+
+        pbclient = MagicMock()
+        pbclient.get_tasks.side_effect = get_tasks
+        pbclient.delete_task.return_value = True
+        self.config.pbclient = pbclient
+
+        res = _delete_tasks(self.config, None, workers=8)
+        assert res == "All tasks and task_runs have been deleted", res
+        deleted = sorted(c[1]['task_id'] for c in
+                         pbclient.delete_task.call_args_list)
+        assert deleted == list(range(1, 251)), deleted
+
     @patch('helpers.find_project_by_short_name')
     def test_delete_connection_error(self, find_mock):
         """Test delete tasks connection error works."""
@@ -0,0 +1,184 @@
+"""Test module for pbs client."""
+import os
+import csv
+import json
+import shutil
+import tempfile
+from io import StringIO
+from helpers import *
+from default import TestDefault
+from mock import patch, MagicMock
+from nose.tools import assert_raises
+import pbclient
+from requests import exceptions
+
+
+class TestPbsExport(TestDefault):
+
+    """Test class for pbs export command."""
+
+    def setUp(self):
+        """Create the output folder."""
+        self.tmp = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp, 'export')
+
+    def tearDown(self):
+        """Remove the output folder."""
+        shutil.rmtree(self.tmp)
+
+    def finder(self, count, domain=pbclient.Task):
+        """Return a find function for count records, and its calls."""
+        calls = []
+
+        def find(project_id, limit, offset, orderby):
+            calls.append(offset)
+            ids = range(offset + 1, min(offset + limit, count) + 1)
+            return [domain(dict(id=i, project_id=project_id,
+                                info=dict(answer=i % 2)))
+                    for i in ids]
+        return find, calls
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_jsonl(self, find_mock):
+        """Test export writes the records in order as JSON lines."""
+        find_mock.return_value = MagicMock(id=1)
+        find, calls = self.finder(25)
+        self.config.pbclient.find_tasks.side_effect = find
+        res = _export(self.config, 'tasks', self.output, limit=10, workers=3)
+        assert res == "25 tasks exported to %s" % self.output, res
+        with open(self.output) as f:
+            records = [json.loads(line) for line in f]
+        assert [r['id'] for r in records] == list(range(1, 26)), records
+        assert records[0]['info'] == dict(answer=1), records
+        # At most workers pages are requested after the last one
+        assert set(calls) <= set([0, 10, 20, 30, 40]), calls
+        assert set(calls) >= set([0, 10, 20]), calls
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_capped_pages(self, find_mock):
+        """Test export gets every record when the server caps the pages."""
+        find_mock.return_value = MagicMock(id=1)
+        find, calls = self.finder(250)
+        # PYBOSSA returns at most 100 records whatever the limit
+        self.config.pbclient.find_tasks.side_effect = \
+            lambda project_id, limit, offset, orderby: find(
+                project_id, min(limit, 100), offset, orderby)
+        res = _export(self.config, 'tasks', self.output, limit=500)
+        assert res == "250 tasks exported to %s" % self.output, res
+        with open(self.output) as f:
+            ids = [json.loads(line)['id'] for line in f]
+        assert ids == list(range(1, 251)), ids
+
+    def test_export_stdout(self):
+        """Test export to stdout only writes the records there."""
+        self.config.pbclient.find_project.return_value = [
+            pbclient.Project(dict(id=1, short_name='short_name'))]
+        find, calls = self.finder(3)
+        self.config.pbclient.find_tasks.side_effect = find
+        with patch('sys.stdout', new_callable=StringIO) as stdout, \
+                patch('sys.stderr', new_callable=StringIO):
+            _export(self.config, 'tasks', '-')
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert [r['id'] for r in records] == [1, 2, 3], records
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_csv(self, find_mock):
+        """Test export writes CSV rows with the JSON fields as JSON."""
+        find_mock.return_value = MagicMock(id=1)
+        find, calls = self.finder(3, pbclient.TaskRun)
+        self.config.pbclient.find_taskruns.side_effect = find
+        res = _export(self.config, 'taskruns', self.output, 'csv')
+        assert res == "3 taskruns exported to %s" % self.output, res
+        with open(self.output) as f:
+            rows = list(csv.DictReader(f))
+        assert [r['id'] for r in rows] == ['1', '2', '3'], rows
+        assert json.loads(rows[1]['info']) == dict(answer=0), rows
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_errors(self, find_mock):
+        """Test export does not leave a partial file on errors."""
+        find_mock.return_value = MagicMock(id=1)
+        self.config.pbclient.find_results.return_value = dict(
+            status='failed', status_code=500, exception_cls='Error',
+            target='result')
+        assert_raises(exceptions.HTTPError, _export, self.config, 'results',
+                      self.output)
+        assert not os.path.exists(self.output)
+
+    def getter(self, count, domain=pbclient.TaskRun):
+        """Return a get function for count records, and its calls."""
+        calls = []
+
+        def get(project_id, limit, last_id):
+            calls.append(last_id)
+            ids = range(last_id + 1, min(last_id + limit, count) + 1)
+            return [domain(dict(id=i, project_id=project_id,
+                                info=dict(answer=i % 2)))
+                    for i in ids]
+        return get, calls
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_incremental(self, find_mock):
+        """Test incremental export only appends the new records."""
+        find_mock.return_value = MagicMock(id=1)
+        get, calls = self.getter(5)
+        self.config.pbclient.get_taskruns.side_effect = get
+        res = _export(self.config, 'taskruns', self.output, 'csv', limit=2,
+                      incremental=True, mark_dir=self.tmp)
+        assert res == "5 new taskruns exported to %s" % self.output, res
+        get, calls = self.getter(8)
+        self.config.pbclient.get_taskruns.side_effect = get
+        res = _export(self.config, 'taskruns', self.output, 'csv', limit=2,
+                      incremental=True, mark_dir=self.tmp)
+        assert res == "3 new taskruns exported to %s" % self.output, res
+        assert calls == [5, 7, 8], calls
+        with open(self.output) as f:
+            rows = list(csv.DictReader(f))
+        assert [r['id'] for r in rows] == [str(i) for i in range(1, 9)], rows
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_incremental_interrupted(self, find_mock):
+        """Test incremental export drops the records after the mark."""
+        find_mock.return_value = MagicMock(id=1)
+        get, calls = self.getter(3)
+        self.config.pbclient.get_taskruns.side_effect = get
+        _export(self.config, 'taskruns', self.output, incremental=True,
+                mark_dir=self.tmp)
+        # Records written after the last commit of the mark
+        with open(self.output, 'a') as f:
+            f.write(json.dumps(dict(id=4)) + '\n{"id": 5')
+        get, calls = self.getter(5)
+        self.config.pbclient.get_taskruns.side_effect = get
+        res = _export(self.config, 'taskruns', self.output, incremental=True,
+                      mark_dir=self.tmp)
+        assert res == "2 new taskruns exported to %s" % self.output, res
+        with open(self.output) as f:
+            ids = [json.loads(line)['id'] for line in f]
+        assert ids == [1, 2, 3, 4, 5], ids
+        # Another file starts a new export
+        other = os.path.join(self.tmp, 'other')
+        res = _export(self.config, 'taskruns', other, incremental=True,
+                      mark_dir=self.tmp)
+        assert res == "5 new taskruns exported to %s" % other, res
+
+    def test_export_mark(self):
+        """Test ExportMark is only used for the same output file."""
+        path = os.path.join(self.tmp, 'marks', 'mark.json')
+        mark = ExportMark(path, self.output, interval=10,
+                          clock=lambda: 100)
+        assert mark.last_id is None and mark.size == 0
+        assert not mark.due()
+        with open(self.output, 'w') as f:
+            f.write('{"id": 7}\n')
+            mark.commit(7, f)
+        assert ExportMark(path, self.output).last_id == 7
+        assert ExportMark(path, self.output).size == 10
+        assert ExportMark(path, 'other').last_id is None
+
+    @patch('helpers.find_project_by_short_name')
+    def test_export_connection_error(self, find_mock):
+        """Test export connection error works."""
+        find_mock.side_effect = exceptions.ConnectionError
+        res = _export(self.config, 'tasks', self.output)
+        assert res == "Connection Error! The server %s is not responding" % \
+            self.config.server, res
@@ -0,0 +1,149 @@
+"""Test module for pbs client."""
+import os
+import shutil
+import tempfile
+from helpers import *
+from helpers import _delete_tasks, _update_tasks_redundancy
+from pbsmirror import Mirror
+from default import TestDefault
+from mock import patch, MagicMock
+import pbclient
+
+
+class TestPbsMirror(TestDefault):
+
+    """Test class for pbs mirror command."""
+
+    def setUp(self):
+        """Create an empty mirror."""
+        self.tmp = tempfile.mkdtemp()
+        self.mirror = Mirror(os.path.join(self.tmp, 'mirror.sqlite'))
+        self.config.mirror = self.mirror
+        self.config.pbclient = MagicMock()
+        self.config.pbclient.Task = pbclient.Task
+        self.records = dict(tasks=[], taskruns=[], results=[])
+        for kind in self.records:
+            getter = getattr(self.config.pbclient, 'get_' + kind)
+            getter.side_effect = self.getter(kind)
+
+    def tearDown(self):
+        """Remove the mirror."""
+        self.config.mirror = None
+        self.mirror.close()
+        shutil.rmtree(self.tmp)
+
+    def getter(self, kind):
+        """Return a get function for the records of kind."""
+        def get(project_id, limit, last_id):
+            records = [r for r in self.records[kind] if r['id'] > last_id]
+            domain = dict(tasks=pbclient.Task, taskruns=pbclient.TaskRun,
+                          results=pbclient.Result)[kind]
+            return [domain(dict(r)) for r in records[:limit]]
+        return get
+
+    def add_task(self, task_id, n_answers=1, runs=0):
+        self.records['tasks'].append(dict(id=task_id, project_id=1,
+                                          state='ongoing', info=dict(),
+                                          n_answers=n_answers))
+        for _ in range(runs):
+            run_id = len(self.records['taskruns']) + 1
+            self.records['taskruns'].append(dict(id=run_id, project_id=1,
+                                                 task_id=task_id,
+                                                 info=dict(answer='a')))
+
+    @patch('helpers.find_project_by_short_name')
+    def test_update_mirror(self, find_mock):
+        """Test mirror only adds the new records."""
+        find_mock.return_value = MagicMock(id=1, short_name='short_name')
+        self.add_task(1, runs=1)
+        self.add_task(2, n_answers=2, runs=1)
+        res = _update_mirror(self.config, limit=1)
+        assert res.endswith(": 2 new tasks, 2 new taskruns, 0 new results"), res
+        self.add_task(3, runs=2)
+        res = _update_mirror(self.config, ('tasks', 'taskruns'))
+        assert res.endswith(": 1 new tasks, 2 new taskruns"), res
+        states = [(t.id, t.state) for t in self.mirror.tasks(1)]
+        assert states == [(1, 'completed'), (2, 'ongoing'),
+                          (3, 'completed')], states
+        # Other projects are not mixed
+        assert list(self.mirror.tasks(2)) == []
+        res = _update_mirror(self.config, ('tasks',), full=True)
+        assert res.endswith(": 3 new tasks"), res
+
+    def test_mirror_remove_tasks(self):
+        """Test Mirror removes tasks with their task runs."""
+        self.add_task(1, runs=2)
+        self.add_task(2, runs=1)
+        for kind in ('tasks', 'taskruns'):
+            self.mirror.add(kind, self.getter(kind)(1, 100, 0))
+        self.mirror.remove_tasks(1, [1])
+        assert [t.id for t in self.mirror.tasks(1)] == [2]
+        assert self.mirror.last_id('taskruns', 1) == 3
+        count = self.mirror.db.execute('SELECT count(*) FROM taskruns')
+        assert count.fetchone()[0] == 1
+
+    @patch('helpers.find_project_by_short_name')
+    def test_delete_tasks_from_mirror(self, find_mock):
+        """Test delete tasks plans from the mirror and updates it."""
+        find_mock.return_value = MagicMock(id=1)
+        self.add_task(1)
+        self.add_task(2)
+        self.mirror.add('tasks', self.getter('tasks')(1, 100, 0))
+        # Created since the last update of the mirror
+        self.add_task(3)
+        self.config.pbclient.delete_task.return_value = True
+        res = _delete_tasks(self.config, None, from_mirror=True)
+        assert res == "All tasks and task_runs have been deleted", res
+        deleted = [c[1]['task_id'] for c in
+                   self.config.pbclient.delete_task.call_args_list]
+        assert sorted(deleted) == [1, 2, 3], deleted
+        assert list(self.mirror.tasks(1)) == []
+
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_from_mirror(self, find_mock):
+        """Test update task redundancy plans from the mirror."""
+        find_mock.return_value = MagicMock(id=1)
+        self.add_task(1, n_answers=1, runs=1)
+        self.add_task(2, n_answers=1)
+        self.add_task(3, n_answers=3)
+        self.config.pbclient.update_task.side_effect = lambda task: task
+        res = _update_tasks_redundancy(self.config, None, 3,
+                                       only_incomplete=True,
+                                       from_mirror=True)
+        msg = "1 tasks redundancy updated (1 planned, 2 skipped)"
+        assert res == msg, res
+        updated = [c[1]['task'].data for c in
+                   self.config.pbclient.update_task.call_args_list]
+        # The stored fields of the task are not sent back to the server
+        assert updated == [dict(id=2, n_answers=3)], updated
+        tasks = [(t.id, t.n_answers, t.state) for t in self.mirror.tasks(1)]
+        assert tasks == [(1, 1, 'completed'), (2, 3, 'ongoing'),
+                         (3, 3, 'ongoing')], tasks
+        # The server is only paged for the new tasks and task runs
+        assert self.config.pbclient.get_tasks.call_count == 2
+
+    @patch('helpers.find_project_by_short_name')
+    def test_from_mirror_deleted_tasks(self, find_mock):
+        """Test tasks deleted in the server are skipped and left the mirror."""
+        find_mock.return_value = MagicMock(id=1)
+        self.add_task(1)
+        self.add_task(2)
+        self.add_task(3)
+        not_found = dict(status='failed', status_code=404, target='task',
+                         exception_cls='NotFound', action='PUT')
+
+        def update_task(task):
+            return not_found if task.id == 2 else task
+        self.config.pbclient.update_task.side_effect = update_task
+        res = _update_tasks_redundancy(self.config, None, 3, from_mirror=True)
+        msg = "2 tasks redundancy updated (3 planned, 0 skipped)"
+        assert res == msg, res
+        tasks = [(t.id, t.n_answers) for t in self.mirror.tasks(1)]
+        assert tasks == [(1, 3), (3, 3)], tasks
+
+        def delete_task(task_id):
+            return not_found if task_id == 1 else True
+        self.config.pbclient.delete_task.side_effect = delete_task
+        res = _delete_tasks(self.config, None, from_mirror=True)
+        assert res == "All tasks and task_runs have been deleted", res
+        assert list(self.mirror.tasks(1)) == []
@@ -1,16 +1,29 @@
+import os
 import pbclient
 import json
+import shutil
+import tempfile
 from helpers import *
 from default import TestDefault
 from mock import patch, MagicMock
 from nose.tools import assert_raises
 from requests import exceptions
 from pbsexceptions import ProjectNotFound
+from pbsretry import RetryPolicy
 
 class TestPbsUpdateProject(TestDefault):
 
     """Test class for pbs update project commands."""
 
+    def setUp(self):
+        """Create a temporary folder for the project files."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary folder."""
+        shutil.rmtree(self.tmp)
+        super(TestPbsUpdateProject, self).tearDown()
+
     @patch('helpers.find_project_by_short_name')
     def test_update_project_create(self, find_mock):
         """Test update_project works."""
@@ -63,6 +76,30 @@ class TestPbsUpdateProject(TestDefault):
                               long_description, tutorial)
         assert res == "Connection Error! The server http://server is not responding", res
 
+    @patch('helpers.find_project_by_short_name')
+    def test_update_project_retry(self, find_mock):
+        """Test update_project retries the server errors."""
+        project = MagicMock()
+        project.info = dict()
+        find_mock.return_value = project
+
+        pbclient = MagicMock()
+        pbclient.update_project.side_effect = [
+            exceptions.ConnectionError, dict(status='failed', status_code=502,
+                                             target='project'),
+            {'short_name': 'short_name'}]
+        self.config.pbclient = pbclient
+        self.config.retry = RetryPolicy(2, sleep=lambda seconds: None)
+        try:
+            res = _update_project(self.config, "test/template.html",
+                                  "test/results.html",
+                                  "test/long_description.md",
+                                  "test/tutorial.html")
+        finally:
+            self.config.retry = None
+        assert res == 'Project short_name updated!', res
+        assert pbclient.update_project.call_count == 3
+
     @patch('helpers.find_project_by_short_name')
     def test_update_project_another_error(self, find_mock):
         """Test update_project another error works."""
@@ -90,3 +127,82 @@ class TestPbsUpdateProject(TestDefault):
         msg = ("Project not found! The project: short_name is missing." \
                " Use the flag --all=1 to search in all the server ")
         assert res == msg, msg
+
+    def test_update_project_only_sends_changes(self):
+        """Test update_project with a manifest only sends changed fields."""
+        project = pbclient.Project(dict(id=1, name='name',
+                                        short_name='short_name',
+                                        description='description',
+                                        long_description='',
+                                        info=dict(thumbnail='thumbnail')))
+        folder = self.tmp
+        files = []
+        for name in ('template.html', 'results.html', 'long_description.md',
+                     'tutorial.html'):
+            files.append(os.path.join(folder, name))
+            with open(files[-1], 'w') as f:
+                f.write(name)
+        task_presenter, results, long_description, tutorial = files
+
+        config = MagicMock()
+        config.project = self.config.project
+        config.pbclient = MagicMock()
+        config.pbclient.Project = pbclient.Project
+        config.retry = None
+        config.pbclient.update_project.return_value = project
+        config.project_cache = None
+        config.manifest = ProjectManifest(os.path.join(folder, 'm.json'))
+        with patch('helpers.find_project_by_short_name') as find_mock:
+            find_mock.side_effect = lambda *args: pbclient.Project(
+                dict(project.data, info=dict(project.info)))
+            res = _update_project(config, task_presenter, results,
+                                  long_description, tutorial)
+            assert res == 'Project short_name updated!', res
+            res = _update_project(config, task_presenter, results,
+                                  long_description, tutorial)
+            assert res == 'Project short_name is up to date', res
+            assert config.pbclient.update_project.call_count == 1
+
+            with open(results, 'w') as f:
+                f.write('new results')
+            res = _update_project(config, task_presenter, results,
+                                  long_description, tutorial)
+        assert res == 'Project short_name updated!', res
+        sent = config.pbclient.update_project.call_args[0][0].data
+        assert sent == dict(id=1, info=dict(results='new results')), sent
+
+    def test_update_project_without_manifest(self):
+        """Test update_project without a manifest sends the server project."""
+        folder = self.tmp
+        files = []
+        for name in ('template.html', 'results.html', 'long_description.md',
+                     'tutorial.html'):
+            files.append(os.path.join(folder, name))
+            with open(files[-1], 'w') as f:
+                f.write(name)
+        task_presenter, results, long_description, tutorial = files
+
+        config = MagicMock()
+        config.project = self.config.project
+        config.pbclient = MagicMock()
+        config.pbclient.Project = pbclient.Project
+        config.retry = None
+        config.manifest = None
+        config.project_cache = ProjectCache(os.path.join(folder, 'c.json'))
+        cached = dict(id=1, name='name', short_name='short_name',
+                      description='description', long_description='',
+                      info=dict(thumbnail='old'))
+        config.project_cache.put('short_name', cached)
+        # The thumbnail was changed in the server after caching the project
+        server = pbclient.Project(dict(cached, info=dict(thumbnail='new')))
+        config.pbclient.update_project.side_effect = lambda project: project
+        with patch('helpers.find_project_by_short_name') as find_mock:
+            find_mock.return_value = server
+            res = _update_project(config, task_presenter, results,
+                                  long_description, tutorial)
+        assert res == 'Project short_name updated!', res
+        sent = config.pbclient.update_project.call_args[0][0]
+        assert sent.info['thumbnail'] == 'new', sent.info
+        assert sent.info['results'] == 'results.html', sent.info
+        cached = config.project_cache.get('short_name')
+        assert cached['info']['thumbnail'] == 'new', cached
@@ -1,21 +1,65 @@
 """Test module for pbs client."""
+import json
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from helpers import _update_tasks_redundancy
 from default import TestDefault
 from mock import patch, MagicMock
 from nose.tools import assert_raises
 from pbsexceptions import *
 from requests import exceptions
+import pbclient
+from pbclient import Task
+
+
+class FakeFormHandler(BaseHTTPRequestHandler):
+
+    """Stand-in for the PYBOSSA redundancy update form."""
+
+    posts = []
+
+    def _reply(self, status, body, cookie=None):
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+    def do_GET(self):
+        if 'api_key=apikey' not in self.path:
+            return self._reply(401, dict(status='error'))
+        form = dict(csrf='token', n_answers=30, errors={})
+        self._reply(200, dict(form=form), cookie='session=s1; Path=/')
+
+    def do_POST(self):
+        length = int(self.headers['content-length'])
+        data = json.loads(self.rfile.read(length).decode('utf-8'))
+        # The token is only valid with the session it was issued for
+        if (self.headers.get('X-CSRFToken') != 'token' or
+                'session=s1' not in (self.headers.get('Cookie') or '')):
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(b'<html>The CSRF token is missing.</html>')
+            return
+        self.posts.append(data)
+        self._reply(200, dict(next='/project/short_name/tasks/',
+                              status='success', flash='Redundancy updated!'))
+
+    def log_message(self, *args):
+        pass
 
 
 class TestPbsUpdateTaskRedundancy(TestDefault):
 
     """Test class for pbs update task redundancy commands."""
 
-    def fake_return_tasks(self, project_id, limit, offset):
+    def fake_return_tasks(self, project_id, limit, last_id):
         """Fake return tasks method."""
         task = MagicMock()
         task.id = 1
-        if offset == 0:
+        if last_id == 0:
             return [task]
         else:
             return []
@@ -59,9 +103,135 @@ class TestPbsUpdateTaskRedundancy(TestDefault):
         pbclient.get_tasks = self.fake_return_tasks
         self.config.pbclient = pbclient
         res = _update_tasks_redundancy(self.config, None, 5)
+        msg = "1 tasks redundancy updated (1 planned, 0 skipped)"
+        assert res == msg, res
+
+
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_bulk(self, find_mock):
+        """Test update task redundancy in bulk sends the form CSRF token."""
+        project = MagicMock()
+        project.short_name = 'short_name'
+        find_mock.return_value = project
+
+        FakeFormHandler.posts = []
+        server = HTTPServer(('127.0.0.1', 0), FakeFormHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        config = MagicMock()
+        config.server = 'http://127.0.0.1:%s' % server.server_port
+        config.api_key = 'apikey'
+        config.project = self.config.project
+        config.project_cache = None
+        config.mirror = None
+        config.session = requests.Session()
+        try:
+            res = _update_tasks_redundancy(config, None, '5', bulk=True)
+        finally:
+            server.shutdown()
+            server.server_close()
         msg = "All tasks redundancy have been updated"
         assert res == msg, res
+        assert FakeFormHandler.posts == [dict(n_answers=5)]
+        assert not config.pbclient.update_task.called
 
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_bulk_fallback(self, find_mock):
+        """Test update task redundancy in bulk falls back to updates."""
+        find_mock.return_value = MagicMock()
+
+        pbclient = MagicMock()
+        pbclient.get_tasks = self.fake_return_tasks
+        self.config.pbclient = pbclient
+        self.config.session.get.return_value.status_code = 404
+        res = _update_tasks_redundancy(self.config, None, '5', bulk=True,
+                                       workers=4)
+        msg = "1 tasks redundancy updated (1 planned, 0 skipped)"
+        assert res == msg, res
+        assert pbclient.update_task.call_count == 1
+
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_only_changes(self, find_mock):
+        """Test update task redundancy skips the tasks that do not change."""
+        find_mock.return_value = MagicMock()
+        tasks = []
+        for i in range(1, 11):
+            task = MagicMock()
+            task.id = i
+            task.n_answers = 5 if i % 2 else 3
+            task.state = 'completed' if i < 5 else 'ongoing'
+            tasks.append(task)
+
+        def get_tasks(project_id, limit, last_id):
+            return [t for t in tasks if t.id > last_id][:limit]
+
+        pbclient = MagicMock()
+        pbclient.Task = Task
+        pbclient.get_tasks.side_effect = get_tasks
+        self.config.pbclient = pbclient
+        res = _update_tasks_redundancy(self.config, None, '5')
+        msg = "5 tasks redundancy updated (5 planned, 5 skipped)"
+        assert res == msg, res
+        updated = [c[1]['task'].id for c in
+                   pbclient.update_task.call_args_list]
+        assert updated == [2, 4, 6, 8, 10], updated
+
+        pbclient.update_task.reset_mock()
+        res = _update_tasks_redundancy(self.config, None, '7',
+                                       only_incomplete=True, min_id=3,
+                                       max_id=8, bulk=True)
+        updated = [c[1]['task'].id for c in
+                   pbclient.update_task.call_args_list]
+        assert updated == [5, 6, 7, 8], updated
+        pbclient.get_tasks.assert_any_call(find_mock().id, limit=100,
+                                           last_id=2)
+
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_capped_pages(self, find_mock):
+        """Test update task redundancy visits every task with capped pages."""
+        find_mock.return_value = MagicMock()
+        tasks = []
+        for i in range(1, 251):
+            task = MagicMock()
+            task.id = i
+            task.n_answers = 1
+            tasks.append(task)
+
+        def get_tasks(project_id, limit, last_id):
+            # PYBOSSA returns at most 100 records whatever the limit
+            return [t for t in tasks if t.id > last_id][:min(limit, 100)]
+
+        pbclient = MagicMock()
+        pbclient.Task = Task
+        pbclient.get_tasks.side_effect = get_tasks
+        self.config.pbclient = pbclient
+        res = _update_tasks_redundancy(self.config, None, 5, limit=300)
+        msg = "250 tasks redundancy updated (250 planned, 0 skipped)"
+        assert res == msg, res
+        updated = [c[1]['task'].id for c in
+                   pbclient.update_task.call_args_list]
+        assert updated == list(range(1, 251)), updated
+
+    @patch('pbclient._pybossa_req')
+    @patch('helpers.find_project_by_short_name')
+    def test_update_task_redundancy_only_sends_n_answers(self, find_mock,
+                                                         req_mock):
+        """Test update task redundancy does not send the other task fields."""
+        find_mock.return_value = MagicMock()
+        task = pbclient.Task(dict(id=1, project_id=1, n_answers=1,
+                                  priority_0=0.5, info=dict(a=1)))
+        client = MagicMock()
+        client.get_tasks.side_effect = [[task], []]
+        client.Task = pbclient.Task
+        client.update_task = pbclient.update_task
+        req_mock.return_value = dict(id=1, n_answers=5)
+        self.config.pbclient = client
+        res = _update_tasks_redundancy(self.config, None, 5)
+        msg = "1 tasks redundancy updated (1 planned, 0 skipped)"
+        assert res == msg, res
+        req_mock.assert_called_once_with('put', 'task', 1,
+                                         payload=dict(n_answers=5))
 
     @patch('helpers.find_project_by_short_name')
     @patch('helpers.enable_auto_throttling')
@@ -0,0 +1,113 @@
+"""Test module for pbs client."""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from io import StringIO
+import click
+import pbsd
+from default import TestDefault
+from mock import patch
+
+
+class TestPbsDaemon(TestDefault):
+
+    """Test class for the pbs daemon and its thin client."""
+
+    def setUp(self):
+        """Start a daemon with a fake pbs."""
+        self.commands = []
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'daemon.sock')
+        self.server = pbsd.create_server(self.path, self.run)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        """Stop the daemon."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp)
+
+    def run(self, args):
+        self.commands.append((args, os.getcwd()))
+        if args == ['fail']:
+            raise click.UsageError('bad usage')
+        if args == ['confirm']:
+            if not click.confirm('Sure?'):
+                raise click.Abort()
+        if args == ['cat']:
+            f = click.File('r').convert('-', None, None)
+            click.echo('%s|%s' % (f.read(3), f.read()))
+            return
+        if args == ['cat-bytes']:
+            click.echo(sys.stdin.buffer.read().decode('utf-8'))
+            return
+        click.echo('done %s' % ' '.join(args))
+        click.echo('warning', err=True)
+
+    def forward(self, args, stdin=''):
+        stdout, stderr = StringIO(), StringIO()
+        code = pbsd.forward(pbsd._connect(self.path), args, StringIO(stdin),
+                            stdout, stderr)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_forward(self):
+        """Test forward runs the command in the daemon."""
+        code, out, err = self.forward(['add-tasks', '--workers', '4'])
+        assert code == 0, code
+        assert out == 'done add-tasks --workers 4\n', out
+        assert err == 'warning\n', err
+        assert self.commands == [(['add-tasks', '--workers', '4'],
+                                  os.getcwd())], self.commands
+        assert sys.stdout is not None and not isinstance(sys.stdout,
+                                                         pbsd._Frames)
+
+    def test_forward_errors(self):
+        """Test forward returns the exit code of click errors."""
+        code, out, err = self.forward(['fail'])
+        assert code == 2, code
+        assert 'bad usage' in err, err
+
+    def test_forward_prompts(self):
+        """Test the prompts of the commands read the client input."""
+        code, out, err = self.forward(['confirm'], stdin='y\n')
+        assert code == 0, code
+        assert out.startswith('Sure? [y/N]: '), out
+        code, out, err = self.forward(['confirm'], stdin='')
+        assert code == 1, code
+        assert 'Aborted!' in err, err
+
+    @patch('pbsd._Input.chunk_size', 4)
+    def test_forward_read(self):
+        """Test the commands read the whole client input."""
+        stdin = 'key,value\n1,ü\n'
+        code, out, err = self.forward(['cat'], stdin=stdin)
+        assert code == 0, err
+        assert out == 'key|,value\n1,ü\n\n', out
+        code, out, err = self.forward(['cat-bytes'], stdin=stdin)
+        assert code == 0, err
+        assert out == stdin + '\n', out
+
+    def test_socket_is_private(self):
+        """Test only the user can connect to the daemon."""
+        assert os.stat(self.path).st_mode & 0o077 == 0
+
+    def test_forward_daemon(self):
+        """Test the daemon does not run another daemon."""
+        code, out, err = self.forward(['--server', 'http://server', 'daemon'])
+        assert code == 2, code
+        assert 'cannot run the daemon' in err, err
+        assert self.commands == [], self.commands
+
+    def test_main_daemon(self):
+        """Test main runs the daemon command without the daemon."""
+        argv = ['pbs', '--server', 'http://server', 'daemon']
+        with patch.dict(os.environ, PBS_DAEMON_SOCKET=self.path), \
+                patch.object(sys, 'argv', argv), \
+                patch('pbsd._connect') as connect, patch('pbs.cli') as cli:
+            pbsd.main()
+        assert not connect.called
+        assert cli.called
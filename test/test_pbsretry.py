@@ -0,0 +1,141 @@
+"""Test module for pbs client."""
+import os
+import json
+import asyncio
+import shutil
+import tempfile
+from default import TestDefault
+from pbsretry import RetryPolicy, DeadLetter, retry_later
+from mock import MagicMock
+from nose.tools import assert_raises
+from requests import exceptions
+from urllib3.exceptions import NewConnectionError, ProtocolError
+
+
+class TestRetryPolicy(TestDefault):
+
+    """Test class for pbsretry."""
+
+    unavailable = {"status": "failed", "status_code": 503}
+
+    def setUp(self):
+        """Create a temporary folder for the dead letter files."""
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary folder."""
+        shutil.rmtree(self.tmp)
+        super(TestRetryPolicy, self).tearDown()
+
+    def policy(self, retries=3):
+        self.slept = []
+        return RetryPolicy(retries, sleep=self.slept.append,
+                           jitter=lambda: 1)
+
+    def test_retries_transient_responses(self):
+        """Test RetryPolicy retries 5xx answers with exponential backoff."""
+        func = MagicMock(side_effect=[self.unavailable, self.unavailable,
+                                      {'id': 1}])
+        policy = self.policy()
+        assert policy.call('update_task', func, dict(task={})) == {'id': 1}
+        assert func.call_count == 3
+        assert self.slept == [0.5, 1.0], self.slept
+
+    def test_creates_retry_later(self):
+        """Test RetryPolicy retries creates the server asked to retry later."""
+        for answer in ({"status": "failed", "status_code": 429},
+                       retry_later(503)):
+            func = MagicMock(side_effect=[answer, {'id': 1}])
+            res = self.policy().call('create_task', func, dict(info={}))
+            assert res == {'id': 1}, res
+
+    def test_creates_not_retried(self):
+        """Test RetryPolicy does not retry creates that may be done."""
+        path = os.path.join(self.tmp, 'failed.jsonl')
+        dead_letter = DeadLetter(path)
+        for failure in ({"status": "failed", "status_code": 502},
+                        {"status": "failed", "status_code": 504},
+                        self.unavailable, ValueError('<html>')):
+            func = MagicMock(side_effect=[failure, {'id': 1}])
+            res = self.policy().call('create_task', func, dict(info={}),
+                                     dead_letter)
+            assert res is None, res
+            assert func.call_count == 1, failure
+        assert dead_letter.count == 4
+        dead_letter.close()
+        func = MagicMock(side_effect=ValueError('<html>'))
+        assert_raises(ValueError, self.policy().call, 'create_task', func, {})
+        assert func.call_count == 1
+
+    def test_delay_is_capped(self):
+        """Test RetryPolicy delays never exceed the cap."""
+        policy = RetryPolicy(base=1, cap=10, jitter=lambda: 0.5)
+        assert policy.delay(1) == 1
+        assert policy.delay(20) == 5
+
+    def test_returns_last_response(self):
+        """Test RetryPolicy returns the error after the last retry."""
+        func = MagicMock(return_value=self.unavailable)
+        policy = self.policy(retries=2)
+        assert policy.call('update_task', func, {}) == self.unavailable
+        assert func.call_count == 3
+
+    def test_does_not_retry_client_errors(self):
+        """Test RetryPolicy does not retry a 4xx answer."""
+        func = MagicMock(return_value=self.error)
+        assert self.policy().call('update_task', func, {}) == self.error
+        assert func.call_count == 1
+
+    def test_connection_errors_of_creates(self):
+        """Test RetryPolicy only retries creates that were not sent."""
+        sent = exceptions.ConnectionError(ProtocolError('reset'))
+        func = MagicMock(side_effect=sent)
+        assert_raises(exceptions.ConnectionError, self.policy().call,
+                      'create_task', func, {})
+        assert func.call_count == 1
+
+        not_sent = MagicMock()
+        not_sent.reason = NewConnectionError(None, 'refused')
+        func = MagicMock(side_effect=[exceptions.ConnectionError(not_sent),
+                                      {'id': 1}])
+        assert self.policy().call('create_task', func, {}) == {'id': 1}
+
+        func = MagicMock(side_effect=[sent, {'id': 1}])
+        assert self.policy().call('update_task', func, {}) == {'id': 1}
+
+    def test_retried_delete_not_found(self):
+        """Test RetryPolicy accepts a 404 when retrying a delete."""
+        func = MagicMock(side_effect=[self.unavailable, self.error_task])
+        assert self.policy().call('delete_task', func, {}) is True
+
+    def test_retries_coroutines(self):
+        """Test RetryPolicy.acall retries a coroutine function."""
+        responses = [self.unavailable, {'id': 1}]
+
+        async def func(**kwargs):
+            return responses.pop(0)
+
+        policy = RetryPolicy(3, base=0)
+        res = asyncio.run(policy.acall('update_task', func, {}))
+        assert res == {'id': 1}, res
+
+    def test_dead_letter(self):
+        """Test RetryPolicy writes the calls that keep failing."""
+        path = os.path.join(self.tmp, 'failed.jsonl')
+        dead_letter = DeadLetter(path)
+        func = MagicMock(return_value=self.unavailable)
+        res = self.policy(retries=1).call('create_task', func,
+                                          dict(info={'key': 1}), dead_letter)
+        assert res is None
+        assert dead_letter.count == 1
+        dead_letter.close()
+        with open(path) as f:
+            record = json.loads(f.readline())
+        assert record['method'] == 'create_task', record
+        assert record['info'] == {'key': 1}, record
+
+    def test_dead_letter_is_lazy(self):
+        """Test DeadLetter only creates the file if a call fails."""
+        path = os.path.join(self.tmp, 'failed.jsonl')
+        DeadLetter(path).close()
+        assert not os.path.exists(path)
@@ -0,0 +1,45 @@
+"""Test module for pbs client."""
+import os
+import sys
+import subprocess
+from default import TestDefault
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only loaded by the commands that need them
+HEAVY_MODULES = ('openpyxl', 'polib', 'watchdog', 'jsonschema', 'aiohttp',
+                 'asyncio')
+
+# Generous budget for `import pbs`, override it with PBS_IMPORT_BUDGET_MS
+IMPORT_BUDGET_MS = int(os.environ.get('PBS_IMPORT_BUDGET_MS', 1000))
+
+
+def import_times(module):
+    """Return the cumulative import times (us) of a fresh import module."""
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import %s' % module],
+                         cwd=ROOT, stderr=subprocess.PIPE,
+                         universal_newlines=True, check=True)
+    times = dict()
+    # Lines are: import time: self [us] | cumulative | imported package
+    for line in res.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup(TestDefault):
+
+    """Test class for the pbs startup time."""
+
+    def test_heavy_modules_are_lazy(self):
+        """Test import pbs does not load the heavy dependencies."""
+        times = import_times('pbs')
+        loaded = [m for m in HEAVY_MODULES if m in times]
+        assert loaded == [], loaded
+
+    def test_import_budget(self):
+        """Test import pbs is within the startup time budget."""
+        times = import_times('pbs')
+        ms = times['pbs'] / 1000.0
+        assert ms < IMPORT_BUDGET_MS, "import pbs took %.0f ms" % ms